@@ -50,6 +50,7 @@ rm -rf $RPM_BUILD_ROOT
 %endif
 %{_bindir}/pungi
 %{_bindir}/pkgorder
+%{_bindir}/pungi-trace
 %{_datadir}/pungi
 %{_mandir}/man8/pungi.8.gz
 /var/cache/pungi
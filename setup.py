@@ -22,6 +22,6 @@ setup(
       license='GPLv2',
       package_dir = {'': 'src'},
       packages = ['pypungi'],
-      scripts = ['src/bin/pungi.py', 'src/bin/pkgorder'],
+      scripts = ['src/bin/pungi.py', 'src/bin/pkgorder', 'src/bin/pungi-trace'],
       data_files=[('/usr/share/pungi', glob.glob('share/*'))]
 )
\ No newline at end of file
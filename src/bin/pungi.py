@@ -15,9 +15,8 @@
 import os
 import pypungi
 import pypungi.config
-import yum
-import pykickstart.parser
-import pykickstart.version
+import pypungi.multiarch
+import pypungi.pool
 import subprocess
 
 def main():
@@ -26,6 +25,28 @@ def main():
 
     (opts, args) = get_arguments(config)
 
+    # Pool maintenance, no compose
+    if opts.cachestats or opts.cachegc:
+        pool = pypungi.pool.PackagePool(os.path.join(config.get('pungi', 'cachedir'), 'pool'))
+        if opts.cachegc:
+            maxbytes = int(config.getfloat('pungi', 'poolsize') * 1024 * 1024)
+            if not maxbytes:
+                print >> sys.stderr, "No pool size limit set, see --pool-size"
+                return 1
+            (removed, freed) = pool.gc(maxbytes)
+            print "Removed %d packages (%d MiB) from the pool" % (removed, freed / 1024 / 1024)
+        if opts.cachestats:
+            stats = pool.stats()
+            print "Pool: %s" % pool.root
+            print "Packages: %d" % stats['entries']
+            print "Size: %d MiB, %d MiB not linked into any tree" % (
+                stats['bytes'] / 1024 / 1024, stats['unshared'] / 1024 / 1024)
+            if stats['entries']:
+                print "Least recently used: %s" % time.ctime(stats['oldest'])
+                print "Most recently used: %s" % time.ctime(stats['newest'])
+        pool.close()
+        return 0
+
     # You must be this high to ride if you're going to do root tasks
     if os.geteuid () != 0 and (opts.do_all or opts.do_buildinstall):
         print >> sys.stderr, "You must run pungi as root"
@@ -43,6 +64,8 @@ def main():
             pass
 
     # Set up the kickstart parser and pass in the kickstart file we were handed
+    import pykickstart.parser
+    import pykickstart.version
     ksparser = pykickstart.parser.KickstartParser(pykickstart.version.makeVersion())
     ksparser.readKickstart(opts.config)
 
@@ -78,39 +101,54 @@ def main():
     if opts.nodebuginfo:
         config.set('pungi', 'debuginfo', "False")
 
+    if opts.refreshmetadata:
+        config.set('pungi', 'revalidate', "False")
+
+    # Flags that change what gather produces
+    if opts.nosource:
+        config.set('pungi', 'source', "False")
+    config.set('pungi', 'selfhosting', str(bool(opts.selfhosting)))
+    config.set('pungi', 'fulltree', str(bool(opts.fulltree)))
+    if opts.trace:
+        config.set('pungi', 'trace', "True")
+    if opts.fullverify:
+        config.set('pungi', 'fullverify', "True")
+
+    # Only work out what a compose would hold
+    if opts.plan:
+        mypungi = pypungi.Pungi(config, ksparser)
+        mypungi._inityum()
+        mypungi.gather()
+        mypungi.plan()
+        return 0
+
+    # Gather several arches at once; the other stages run per arch.
+    if opts.arches:
+        if opts.do_all or opts.do_createrepo or opts.do_buildinstall or \
+           opts.do_createiso or opts.sourceisos:
+            print >> sys.stderr, "--arches only works with the gather stage (-G)"
+            return 1
+        gathered = pypungi.multiarch.gatherArches(config, opts.config,
+                                                  opts.arches.split(','), opts.gatherworkers)
+        for arch in sorted(gathered.keys()):
+            (polist, srpmpolist, debuginfolist) = gathered[arch]
+            print "%s: %d packages, %d source, %d debuginfo" % (
+                arch, len(polist), len(srpmpolist), len(debuginfolist))
+        print "All done!"
+        return 0
+
     # Actually do work.
     mypungi = pypungi.Pungi(config, ksparser)
 
     if not opts.sourceisos:
-        if opts.do_all or opts.do_gather or opts.do_buildinstall:
+        if opts.do_all or opts.do_gather:
             mypungi._inityum() # initialize the yum object for things that need it
+        elif opts.do_buildinstall and not mypungi.loadSackSnapshot():
+            mypungi._inityum() # no usable snapshot from an earlier gather stage
+        elif opts.do_createiso:
+            mypungi.loadSackSnapshot() # for the package order of split media
         if opts.do_all or opts.do_gather:
-            mypungi.getPackageObjects()
-            if not opts.nosource or opts.selfhosting or opts.fulltree:
-                mypungi.createSourceHashes()
-                mypungi.getSRPMList()
-            if opts.selfhosting:
-                mypungi.resolvePackageBuildDeps()
-            if opts.fulltree:
-                mypungi.completePackageSet()
-            if opts.selfhosting and opts.fulltree:
-                # OUCH.
-                while 1:
-                    plen = len(mypungi.srpmpolist)
-                    mypungi.resolvePackageBuildDeps()
-                    if plen == len(mypungi.srpmpolist):
-                        break
-                    plen = len(mypungi.srpmpolist)
-                    mypungi.completePackageSet()
-                    if plen == len(mypungi.srpmpolist):
-                        break
-            mypungi.downloadPackages()
-            mypungi.makeCompsFile()
-            if not opts.nodebuginfo:
-                mypungi.getDebuginfoList()
-                mypungi.downloadDebuginfo()
-            if not opts.nosource:
-                mypungi.downloadSRPMs()
+            mypungi.doGather()
 
         if opts.do_all or opts.do_createrepo:
            mypungi.doCreaterepo()
@@ -167,6 +205,22 @@ if __name__ == '__main__':
         parser.add_option("--cachedir", dest="cachedir", type="string",
           action="callback", callback=set_config, callback_args=(config, ),
           help='package cache directory (defaults to /var/cache/pungi)')
+        parser.add_option("--repo-workers", dest="repoworkers", type="string",
+          action="callback", callback=set_config, callback_args=(config, ),
+          help='number of repos to fetch metadata for at once (defaults to 4)')
+        parser.add_option("--download-workers", dest="downloadworkers", type="string",
+          action="callback", callback=set_config, callback_args=(config, ),
+          help='number of packages to download at once from each host (defaults to 4)')
+        parser.add_option("--download-retries", dest="downloadretries", type="string",
+          action="callback", callback=set_config, callback_args=(config, ),
+          help='number of times to retry a failed package download, with growing pauses (defaults to 3)')
+        parser.add_option("--pool-size", dest="poolsize", type="string",
+          action="callback", callback=set_config, callback_args=(config, ),
+          help='size in MiB to trim the package pool in the cachedir to, 0 for no limit (defaults to 0)')
+        parser.add_option("--cache-stats", default=False, action="store_true", dest="cachestats",
+          help='report on the package pool in the cachedir and exit')
+        parser.add_option("--cache-gc", default=False, action="store_true", dest="cachegc",
+          help='trim the package pool in the cachedir to --pool-size and exit')
         parser.add_option("--bugurl", dest="bugurl", type="string",
           action="callback", callback=set_config, callback_args=(config, ),
           help='the url for your bug system (defaults to http://bugzilla.redhat.com)')
@@ -182,6 +236,18 @@ if __name__ == '__main__':
           help='disable creation of split media (optional)')
         parser.add_option("--sourceisos", default=False, action="store_true", dest="sourceisos",
           help='Create the source isos (other arch runs must be done)')
+        parser.add_option("--refresh-metadata", default=False, action="store_true", dest="refreshmetadata",
+          help='always download fresh repo metadata instead of revalidating the cached copy (optional)')
+        parser.add_option("--arches", dest="arches", type="string",
+          help='comma separated list of arches to gather in one run, with -G (optional)')
+        parser.add_option("--gather-workers", dest="gatherworkers", type="int",
+          help='number of arches to gather at once with --arches (defaults to one per cpu)')
+        parser.add_option("--plan", default=False, action="store_true", dest="plan",
+          help='only gather, and report package counts, download sizes and media split (optional)')
+        parser.add_option("--trace", default=False, action="store_true", dest="trace",
+          help='record why each package was gathered in the workdir, for pungi-trace (optional)')
+        parser.add_option("--full-verify", default=False, action="store_true", dest="fullverify",
+          help='checksum every cached package and tree file again instead of trusting earlier sums (optional)')
         parser.add_option("--force", default=False, action="store_true",
           help='Force reuse of an existing destination directory (will overwrite files)')
 
@@ -201,7 +267,7 @@ if __name__ == '__main__':
 
         (opts, args) = parser.parse_args()
 
-        if not opts.config:
+        if not opts.config and not (opts.cachestats or opts.cachegc):
             parser.print_help()
             sys.exit(0)
 
@@ -209,7 +275,8 @@ if __name__ == '__main__':
             print >> sys.stderr, "Flavor must be alphanumeric."
             sys.exit(1)
 
-        if opts.do_gather or opts.do_createrepo or opts.do_buildinstall or opts.do_createiso:
+        if opts.do_gather or opts.do_createrepo or opts.do_buildinstall or opts.do_createiso or \
+           opts.plan:
             opts.do_all = False
         return (opts, args)
 
@@ -12,19 +12,46 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+import collections
 import ConfigParser
-import createrepo
+import fnmatch
 import gzip
+import hashlib
 import logging
+import multiprocessing.pool
 import os
+import pypungi.checksums
+import pypungi.comps
+import pypungi.debuginfo
+import pypungi.download
+import pypungi.fileprovides
+import pypungi.installorder
+import pypungi.matcher
+import pypungi.pkgtable
+import pypungi.pool
+import pypungi.provides
+import pypungi.sourceindex
+import pypungi.sqlsack
 import pypungi.splittree
+import pypungi.trace
 import pypungi.util
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
-import urlgrabber.progress
-import yum
+import tempfile
+import time
+import urlparse
+
+# These are slow to import and only needed by some stages, so they are
+# imported on first use.
+createrepo = pypungi.util._LazyModule('createrepo')
+rpmUtils = pypungi.util._LazyModule('rpmUtils', 'rpmUtils.miscutils')
+sqlitecachec = pypungi.util._LazyModule('sqlitecachec')
+urlgrabber = pypungi.util._LazyModule('urlgrabber', 'urlgrabber.grabber')
+yum = pypungi.util._LazyModule('yum', 'yum.misc', 'yum.packageSack', 'yum.repoMDObject')
+yumbase = pypungi.util._LazyModule('pypungi.yumbase')
 
 from . import exceptions
 from .__version__ import version as __version__
@@ -70,41 +97,6 @@ class PungiBase(object):
                             filename=logfile)
 
 
-class CallBack(urlgrabber.progress.TextMeter):
-    """A call back function used with yum."""
-
-    def progressbar(self, current, total, name=None):
-        return
-
-
-class PungiYum(yum.YumBase):
-    """Subclass of Yum"""
-
-    def __init__(self, config):
-        self.pungiconfig = config
-        yum.YumBase.__init__(self)
-        self.conf = config
-
-    def doLoggingSetup(self, debuglevel, errorlevel, syslog_ident=None, syslog_facility=None):
-        """Setup the logging facility."""
-
-        logdir = os.path.join(self.pungiconfig.get('pungi', 'destdir'), 'logs')
-        if not os.path.exists(logdir):
-            os.makedirs(logdir)
-        if self.pungiconfig.get('pungi', 'flavor'):
-            logfile = os.path.join(logdir, '%s.%s.log' % (self.pungiconfig.get('pungi', 'flavor'),
-                                                          self.pungiconfig.get('pungi', 'arch')))
-        else:
-            logfile = os.path.join(logdir, '%s.log' % (self.pungiconfig.get('pungi', 'arch')))
-
-        yum.logging.basicConfig(level=yum.logging.DEBUG, filename=logfile)
-
-    def doFileLogSetup(self, uid, logfile):
-        # This function overrides a yum function, allowing pungi to control
-        # the logging.
-        pass
-
-
 class Pungi(pypungi.PungiBase):
     def __init__(self, config, ksparser):
         pypungi.PungiBase.__init__(self, config)
@@ -136,13 +128,36 @@ class Pungi(pypungi.PungiBase):
                                     '.composeinfo')
 
         self.ksparser = ksparser
-        self.polist = []
-        self.srpmpolist = []
-        self.debuginfolist = []
-        self.srpms_build = []
-        self.srpms_fulltree = []
+        self.snapshotpath = os.path.join(self.workdir, 'sack-snapshot.pickle')
+        self.arches = []
+        self.polist = pypungi.pkgtable.PackageTable(self._lookupPackage)
+        self.srpmpolist = pypungi.pkgtable.PackageTable(self._lookupPackage)
+        self.debuginfolist = pypungi.pkgtable.PackageTable(self._lookupPackage)
+        self.srpms_build = set() # source rpms whose build deps we resolved
+        self.srpms_fulltree = set() # source rpms whose binaries we all added
         self.last_po = 0
-        self.resolved_deps = {} # list the deps we've already resolved, short circuit.
+        self.resolved_deps = {} # requirement -> providers chosen for it, short circuit.
+        self.unresolved_deps = {} # deps nothing provides, so we only look once
+        self.providesindex = None # loaded on first use by _whatProvides
+        self.fileindex = None # loaded along with providesindex
+        self.gathercachepath = None # worked out on first use by _gatherCachePath
+        self.sourceindex = None # built on first use by getSourceIndex
+        self.nameindex = None # built on first use by getNameIndex
+        self.sqlsack = None # set up on first use by _getSqlSack
+        self.depgraph = {} # package key -> keys of the packages added for its requirements
+        self.orderseeds = [] # (group, package keys) selected by the kickstart, in order
+        self.pkgorder = None # install order for splittree, see doPackageorder
+        self.pool = None # opened on first use by _getPool
+        self.checksummemo = None # opened on first use by _getChecksumMemo
+        self.poolpaths = {} # package key -> path in the pool, see _fetchPackages
+        self.trace = None # a DepsolveTrace when the trace config flag is set
+        if self.config.getboolean('pungi', 'trace'):
+            self.trace = pypungi.trace.DepsolveTrace()
+        self.tracepath = os.path.join(self.workdir, 'depsolve-trace.pickle')
+        self.conditionalindex = {} # package object -> conditionals it is listed under
+        self.compsxml = None # merged comps, see _mergedComps
+        self.compsexpansion = None # built on first use by getCompsExpansion
+        self.visited_pos = set() # package objects already walked by resolveDepClosure
 
     def _inityum(self):
         """Initialize the yum object.  Only needed for certain actions."""
@@ -150,7 +165,7 @@ class Pungi(pypungi.PungiBase):
         # Create a yum object to use
         self.repos = []
         self.mirrorlists = []
-        self.ayum = PungiYum(self.config)
+        self.ayum = yumbase.PungiYum(self.config)
         self.ayum.doLoggingSetup(6, 6)
         yumconf = yum.config.YumConf()
         yumconf.debuglevel = 6
@@ -183,6 +198,7 @@ class Pungi(pypungi.PungiBase):
         self.ayum.compatarch = yumarch
         arches = yum.rpmUtils.arch.getArchList(yumarch)
         arches.append('src') # throw source in there, filter it later
+        self.arches = arches
 
         # deal with our repos
         try:
@@ -203,7 +219,12 @@ class Pungi(pypungi.PungiBase):
                 thisrepo.baseurl = yum.parser.varReplace(repo.baseurl, self.ayum.conf.yumvar)
                 self.repos.extend(thisrepo.baseurl)
                 self.logger.info('URL for repo %s is %s' % (thisrepo.name, thisrepo.baseurl))
-            thisrepo.basecachedir = self.ayum.conf.cachedir
+            # Repos whose url depends on the arch get a cache of their own,
+            # so composes of different arches can share the cachedir.
+            if '$basearch' in (repo.mirrorlist or repo.baseurl or ''):
+                thisrepo.basecachedir = os.path.join(self.ayum.conf.cachedir, yumvars['basearch'])
+            else:
+                thisrepo.basecachedir = self.ayum.conf.cachedir
             thisrepo.enablegroups = True
             thisrepo.failovermethod = 'priority' # This is until yum uses this failover by default
             thisrepo.exclude = repo.excludepkgs
@@ -216,17 +237,22 @@ class Pungi(pypungi.PungiBase):
                 thisrepo.proxy = repo.proxy
             self.ayum.repos.add(thisrepo)
             self.ayum.repos.enableRepo(thisrepo.id)
-            self.ayum._getRepos(thisrepo=thisrepo.id, doSetup = True)
 
-        self.ayum.repos.setProgressBar(CallBack())
-        self.ayum.repos.callback = CallBack()
+        self.ayum.repos.setProgressBar(yumbase.CallBack())
+        self.ayum.repos.callback = yumbase.CallBack()
 
-        # Set the metadata and mirror list to be expired so we always get new ones.
-        for repo in self.ayum.repos.listEnabled():
-            repo.metadata_expire = 0
-            repo.mirrorlist_expire = 0
-            if os.path.exists(os.path.join(repo.cachedir, 'repomd.xml')):
-                os.remove(os.path.join(repo.cachedir, 'repomd.xml'))
+        # Set up and fetch the metadata of all repos at once; _getSacks then
+        # only has to open what is already in the cache, in the usual repo
+        # order.
+        repos = self.ayum.repos.listEnabled()
+        workers = max(1, min(self.config.getint('pungi', 'repoworkers'), len(repos)))
+        self.logger.info('Preparing %d repos with %d workers' % (len(repos), workers))
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            pool.map(self._prepareRepo, repos)
+        finally:
+            pool.close()
+            pool.join()
 
         self.logger.info('Getting sacks for arches %s' % arches)
         self.ayum._getSacks(archlist=arches)
@@ -234,6 +260,331 @@ class Pungi(pypungi.PungiBase):
         self.logger.info("Merging aym config...")
         self.ayum.conf.exclude.extend(self.ksparser.handler.packages.excludedList)
 
+    def _repoSetKey(self):
+        """Return a digest of the kickstart repo definitions, arch and
+           version; anything derived from the repos is only reusable while
+           this stays the same.  Does not need yum, and leaves the kickstart
+           alone: the url method goes in as itself rather than through
+           methodToRepo(), which adds another repo on every call."""
+
+        key = [self.config.get('pungi', 'arch'), self.config.get('pungi', 'version'),
+               getattr(self.ksparser.handler.method, 'url', None)]
+        for repo in self.ksparser.handler.repo.repoList:
+            if repo.name == 'ks-method-url':
+                continue # _inityum's methodToRepo() added it for the url above
+            key.append((repo.name, repo.baseurl, repo.mirrorlist, repo.cost, repo.proxy,
+                        repo.ignoregroups, repo.includepkgs, repo.excludepkgs))
+        return hashlib.sha256(repr(key)).hexdigest()
+
+    def saveSackSnapshot(self):
+        """Write what later stages of this compose need from the parsed
+           repos to the workdir, so they can skip _inityum()."""
+
+        snapshot = {
+            'key': self._repoSetKey(),
+            'repos': self.repos,
+            'mirrorlists': self.mirrorlists,
+            'arches': self.arches,
+            'compatarch': self.ayum.compatarch,
+            'repomd': self._repomdChecksums(),
+            'comps': self._mergedComps(),
+            'provides': self.providesindex and self.providesindex.path,
+            'depgraph': self.depgraph,
+            'orderseeds': self.orderseeds,
+        }
+        for name in ('polist', 'srpmpolist', 'debuginfolist'):
+            snapshot[name] = list(getattr(self, name))
+
+        pypungi.util._writePickle(self.snapshotpath, snapshot)
+        self.logger.info('Saved repo snapshot to %s' % self.snapshotpath)
+
+    def loadSackSnapshot(self):
+        """Load the snapshot written by saveSackSnapshot() in an earlier
+           stage.  Returns False, leaving _inityum() to the caller, if there
+           is none or it was made for a different repo set or arch."""
+
+        snapshot = pypungi.util._readPickle(self.snapshotpath)
+        if snapshot is None:
+            self.logger.info('No repo snapshot in %s' % self.snapshotpath)
+            return False
+        if snapshot['key'] != self._repoSetKey():
+            self.logger.info('Repo snapshot %s is for different repos or arch' % self.snapshotpath)
+            return False
+
+        self.repos = snapshot['repos']
+        self.mirrorlists = snapshot['mirrorlists']
+        self.arches = snapshot['arches']
+        self.compsxml = snapshot['comps']
+        self.depgraph = snapshot.get('depgraph', {})
+        self.orderseeds = snapshot.get('orderseeds', [])
+        for name in ('polist', 'srpmpolist', 'debuginfolist'):
+            setattr(self, name, pypungi.pkgtable.PackageTable(self._lookupPackage, snapshot[name]))
+        if snapshot['provides'] and os.path.exists(snapshot['provides']):
+            self.providesindex = pypungi.provides.ProvidesIndex(snapshot['provides'])
+
+        self.logger.info('Loaded repo snapshot from %s' % self.snapshotpath)
+        return True
+
+    def _prepareRepo(self, repo):
+        """Set up a repo, make sure its cached metadata is current and get
+           its primary metadata ready for the sack.  Runs in a worker
+           thread, one repo per call; anything that fails here is left for
+           _getSacks to retry and report.  Other pungi processes sharing the
+           cachedir wait for us, then find the metadata current."""
+
+        pypungi.util._ensuredir(repo.basecachedir, self.logger, force=True)
+        lock = pypungi.util._lockFile(os.path.join(repo.basecachedir, '.%s.lock' % repo.id))
+        try:
+            try:
+                self.ayum._getRepos(thisrepo=repo.id, doSetup = True)
+            except (yum.Errors.RepoError, urlgrabber.grabber.URLGrabError), e:
+                self.logger.warn('Could not set up %s: %s' % (repo.id, e))
+                return
+            self._fetchRepo(repo)
+        finally:
+            lock.close()
+
+    def _fetchRepo(self, repo):
+        """Revalidate a repo's cached metadata and prefetch its primary
+           database.  Called by _prepareRepo with the repo locked."""
+
+        # Make sure we never compose from stale metadata: either the cached
+        # repomd.xml still matches the mirror, or we throw it away.
+        repo.mirrorlist_expire = 0
+        if self.config.getboolean('pungi', 'revalidate') and self._revalidateRepo(repo):
+            repo.metadata_expire = -1 # still current, use the cache as is
+        else:
+            repo.metadata_expire = 0
+            if os.path.exists(os.path.join(repo.cachedir, 'repomd.xml')):
+                os.remove(os.path.join(repo.cachedir, 'repomd.xml'))
+
+        try:
+            if 'primary_db' in repo.repoXML.fileTypes():
+                yum.misc.decompress(repo.retrieveMD('primary_db'))
+            else:
+                # Parse the xml into yum's sqlite cache here, in the worker;
+                # the sack finds it current and only opens it.  The
+                # connection can not be handed to the main thread, so close
+                # it.
+                parser = sqlitecachec.RepodataParserSqlite(repo.cachedir, repo.id, None)
+                parser.getPrimary(repo.retrieveMD('primary'),
+                                  repo.repoXML.getData('primary').checksum[1]).close()
+        except (yum.Errors.RepoError, urlgrabber.grabber.URLGrabError, IOError, OSError), e:
+            self.logger.warn('Could not prefetch metadata for %s: %s' % (repo.id, e))
+
+    def _repomdSignature(self, repoid, path):
+        """Return the checksums and timestamps of everything a repomd.xml
+           file lists, or None if it can not be parsed."""
+
+        try:
+            repomd = yum.repoMDObject.RepoMD(repoid, path)
+        except (yum.Errors.RepoMDError, IOError, SyntaxError), e:
+            self.logger.debug('Could not parse %s: %s' % (path, e))
+            return None
+
+        signature = {}
+        for (mdtype, data) in repomd.repoData.iteritems():
+            signature[mdtype] = (data.checksum, data.timestamp)
+        return signature
+
+    def _revalidateRepo(self, repo):
+        """Fetch only the repomd.xml of a repo and compare it with the
+           cached copy.  Returns True if the cached metadata is current."""
+
+        cached = os.path.join(repo.cachedir, 'repomd.xml')
+        if not os.path.exists(cached):
+            self.logger.info('Metadata cache miss for %s: nothing cached' % repo.id)
+            return False
+
+        (fd, fresh) = tempfile.mkstemp(dir=self.workdir, prefix='repomd-%s-' % repo.id)
+        os.close(fd)
+        try:
+            try:
+                repo.grab.urlgrab(os.path.join('repodata', 'repomd.xml'), fresh, copy_local=1)
+            except (urlgrabber.grabber.URLGrabError, yum.Errors.RepoError), e:
+                self.logger.info('Metadata cache miss for %s: %s' % (repo.id, e))
+                return False
+
+            oldsig = self._repomdSignature(repo.id, cached)
+            if oldsig is None or oldsig != self._repomdSignature(repo.id, fresh):
+                self.logger.info('Metadata cache miss for %s: repomd.xml changed' % repo.id)
+                return False
+        finally:
+            os.remove(fresh)
+
+        self.logger.info('Metadata cache hit for %s' % repo.id)
+        return True
+
+    def _repomdChecksums(self):
+        """Return a list of (repo id, checksum) pairs of the repomd.xml of
+           every enabled repo.  Requires yum to be initialized."""
+
+        sums = []
+        for repo in self.ayum.repos.listEnabled():
+            repomd = os.path.join(repo.cachedir, 'repomd.xml')
+            sums.append((repo.id, pypungi.util._doCheckSum(repomd, 'sha256', self.logger)))
+        return sums
+
+    def _primaryProvides(self):
+        """Generate provides index records from the primary metadata of
+           every enabled repo, both real provides and the file subset."""
+
+        columns = 'packages.name, packages.arch, packages.epoch, packages.version, packages.release'
+        for repo in self.ayum.repos.listEnabled():
+            cur = repo.sack.primarydb[repo].cursor()
+            cur.execute('SELECT provides.name, %s, provides.flags, provides.epoch, '
+                        'provides.version, provides.release '
+                        'FROM provides JOIN packages USING (pkgKey)' % columns)
+            for row in cur:
+                yield (row[0], row[1:6], row[6:10])
+            cur.execute('SELECT files.name, %s FROM files JOIN packages USING (pkgKey)' % columns)
+            for row in cur:
+                yield (row[0], row[1:6], (None, None, None, None))
+
+    def _loadProvidesIndex(self):
+        """Open the provides index for the current repo metadata, building
+           it in the cachedir if no earlier run has done so."""
+
+        digest = hashlib.sha256(repr(self._repomdChecksums())).hexdigest()
+        indexdir = os.path.join(self.config.get('pungi', 'cachedir'), 'provides')
+        pypungi.util._ensuredir(indexdir, self.logger, force=True)
+        indexpath = os.path.join(indexdir, '%s.idx' % digest)
+
+        # The index is arch neutral; when several arches are gathered at
+        # once the first one builds it and the others wait and reuse it.
+        lock = pypungi.util._lockFile('%s.lock' % indexpath)
+        try:
+            if not os.path.exists(indexpath):
+                self.logger.info('Building provides index %s' % indexpath)
+                pypungi.provides.buildIndex(indexpath, self._primaryProvides())
+            else:
+                self.logger.info('Reusing provides index %s' % indexpath)
+        finally:
+            lock.close()
+        self.providesindex = pypungi.provides.ProvidesIndex(indexpath)
+        self.fileindex = pypungi.fileprovides.FileIndex(os.path.join(indexdir, '%s.files' % digest))
+
+    def _addUnresolved(self, req):
+        """Remember a requirement that nothing provides, for this run only:
+           the answer depends on the compose's excludes, and the fileindex
+           already keeps what the filelists said."""
+
+        self.unresolved_deps[req] = None
+        if req[0].startswith('/'):
+            self.unresolved_deps[req[0]] = None
+
+    def _isUnresolved(self, req):
+        """Check whether a requirement is already known to be unresolvable."""
+
+        return self.unresolved_deps.has_key(req) or self.unresolved_deps.has_key(req[0])
+
+    def _whatProvides(self, r, f, v):
+        """Return a list of package objects providing a requirement,
+           answering from the provides index where we can."""
+
+        if self.providesindex is None:
+            self._loadProvidesIndex()
+
+        provided = self.providesindex.lookup(r)
+        if not provided and r.startswith('/'):
+            # Only a subset of files makes it into primary
+            return self._fileProviders(r, f, v)
+
+        pos = []
+        for (pkgtup, (pf, pe, pv, pr)) in provided:
+            if not rpmUtils.miscutils.rangeCompare((r, f, v), (r, pf, (pe, pv, pr))):
+                continue
+            for po in self.ayum.pkgSack.searchPkgTuple(pkgtup):
+                if po not in pos:
+                    pos.append(po)
+        return pos
+
+    def _scanFilelists(self, repo, paths):
+        """Search one repo's filelists for paths.  Returns a dict of path
+           -> package tuples, or None if the filelists can not be read."""
+
+        try:
+            if 'filelists_db' in repo.repoXML.fileTypes() and \
+               hasattr(repo.sack, 'primarydb') and repo.sack.primarydb.has_key(repo):
+                dbpath = yum.misc.decompress(repo.retrieveMD('filelists_db'))
+                filelistsdb = sqlite3.connect(dbpath)
+                try:
+                    return pypungi.fileprovides.scanFilelistsDb(
+                        filelistsdb, repo.sack.primarydb[repo], paths)
+                finally:
+                    filelistsdb.close()
+
+            filelists = gzip.open(repo.retrieveMD('filelists'), 'rb')
+            try:
+                return pypungi.fileprovides.scanFilelistsXml(filelists, paths)
+            finally:
+                filelists.close()
+        except (yum.Errors.RepoError, urlgrabber.grabber.URLGrabError, IOError, OSError,
+                sqlite3.Error, SyntaxError), e:
+            self.logger.warn('Could not search the filelists of %s: %s' % (repo.id, e))
+            return None
+
+    def _resolveFiles(self, paths):
+        """Make sure the file index knows about paths, searching the
+           filelists of every repo once for all of the paths that neither
+           primary nor an earlier search answered."""
+
+        if self.providesindex is None:
+            self._loadProvidesIndex()
+
+        missing = []
+        for path in paths:
+            if path not in missing and self.fileindex.lookup(path) is None and \
+               not self.providesindex.lookup(path):
+                missing.append(path)
+        if not missing:
+            return
+
+        self.logger.info('Searching filelists for %d files' % len(missing))
+        found = dict([(path, []) for path in missing])
+        for repo in self.ayum.repos.listEnabled():
+            result = self._scanFilelists(repo, missing)
+            if result is None:
+                return # don't remember an incomplete answer
+            for (path, pkgtups) in result.iteritems():
+                found[path].extend(pkgtups)
+        self.fileindex.add(found)
+
+    def _fileProviders(self, r, f, v):
+        """Return a list of package objects providing a file that is not
+           in the primary metadata."""
+
+        self._resolveFiles([r])
+        pkgtups = self.fileindex.lookup(r)
+        if pkgtups is None:
+            # The filelists could not be searched; let yum try.
+            return self.ayum.whatProvides(r, f, v).returnPackages()
+
+        pos = []
+        for pkgtup in pkgtups:
+            for po in self.ayum.pkgSack.searchPkgTuple(pkgtup):
+                if po not in pos:
+                    pos.append(po)
+        return pos
+
+    def _findPackage(self, repoid, pkgtup):
+        """Return the package object for pkgtup from repo repoid, or None if
+           the sack does not have it."""
+
+        for po in self.ayum.pkgSack.searchPkgTuple(pkgtup):
+            if po.repoid == repoid:
+                return po
+        return None
+
+    def _lookupPackage(self, entry):
+        """Resolve a package table entry back to its package object."""
+
+        po = self._findPackage(entry.repoid, entry.pkgtup)
+        if po is None:
+            raise exceptions.MissingPackageError('%s is no longer available from repo %s' % (
+                '-'.join(entry.pkgtup), entry.repoid))
+        return po
+
     def _filtersrcdebug(self, po):
         """Filter out package objects that are of 'src' arch."""
 
@@ -242,6 +593,24 @@ class Pungi(pypungi.PungiBase):
 
         return True
 
+    def _getChecksumMemo(self):
+        """Return the checksum memo in the cachedir.  The fullverify config
+           flag makes it sum every file again."""
+
+        if self.checksummemo is None:
+            pypungi.util._ensuredir(self.config.get('pungi', 'cachedir'), self.logger, force=True)
+            self.checksummemo = pypungi.checksums.ChecksumMemo(
+                os.path.join(self.config.get('pungi', 'cachedir'), 'checksums.db'),
+                trust=not self.config.getboolean('pungi', 'fullverify'))
+        return self.checksummemo
+
+    def _closeChecksumMemo(self):
+        """Write out and close the checksum memo at the end of a stage."""
+
+        if self.checksummemo is not None:
+            self.checksummemo.close()
+            self.checksummemo = None
+
     def verifyCachePkg(self, po, path): # Stolen from yum
         """check the package checksum vs the cache
            return True if pkg is good, False if not"""
@@ -249,8 +618,8 @@ class Pungi(pypungi.PungiBase):
         (csum_type, csum) = po.returnIdSum()
 
         try:
-            filesum = yum.misc.checksum(csum_type, path)
-        except yum.Errors.MiscError:
+            filesum = self._getChecksumMemo().hexdigest(path, csum_type)
+        except (ValueError, IOError, OSError):
             return False
 
         if filesum != csum:
@@ -260,7 +629,10 @@ class Pungi(pypungi.PungiBase):
 
     def getPackageDeps(self, po):
         """Add the dependencies for a given package to the
-           transaction info"""
+           transaction info.
+
+           Returns a list of the package objects that were added.  This does
+           not recurse; use resolveDepClosure() to follow the new packages."""
 
         self.logger.info('Checking deps of %s.%s' % (po.name, po.arch))
 
@@ -268,72 +640,226 @@ class Pungi(pypungi.PungiBase):
         provs = po.provides
         added = []
 
+        # Search the filelists once for all file requirements of the package
+        # that the primary metadata does not cover.
+        self._resolveFiles([r for (r, f, v) in reqs
+                            if r.startswith('/') and not self.resolved_deps.has_key((r, f, v))
+                            and not self._isUnresolved((r, f, v))])
+
         for req in reqs:
-            if self.resolved_deps.has_key(req):
-                continue
             (r,f,v) = req
             if r.startswith('rpmlib(') or r.startswith('config('):
                 continue
             if req in provs:
                 continue
+            if self.resolved_deps.has_key(req):
+                # Resolved for an earlier package, so no lookup, but this
+                # package needs the same providers
+                for dep in self.resolved_deps[req]:
+                    self._recordDep(po, req, dep)
+                continue
+            if self._isUnresolved(req):
+                self.logger.warn("Unresolvable dependency %s in %s.%s" % (r, po.name, po.arch))
+                continue
 
-            deps = self.ayum.whatProvides(r, f, v).returnPackages()
+            if self.trace is not None:
+                start = time.time()
+            deps = self._whatProvides(r, f, v)
+            if self.trace is not None:
+                self.trace.addTiming(req, time.time() - start)
             if not deps:
                 self.logger.warn("Unresolvable dependency %s in %s.%s" % (r, po.name, po.arch))
+                self._addUnresolved(req)
                 continue
 
             depsack = yum.packageSack.ListPackageSack(deps)
 
+            chosen = []
             for dep in depsack.returnNewestByNameArch():
                 self.ayum.tsInfo.addInstall(dep)
                 self.logger.info('Added %s.%s for %s.%s' % (dep.name, dep.arch, po.name, po.arch))
                 added.append(dep)
-            self.resolved_deps[req] = None
-        for add in added:
-            self.getPackageDeps(add)
+                chosen.append(dep)
+                self._recordDep(po, req, dep)
+            self.resolved_deps[req] = chosen
+
+        return added
+
+    def _recordDep(self, po, req, dep):
+        """Record in the dependency graph (for install order) and the trace
+           that po needs dep for req."""
+
+        if po.arch != 'src':
+            self.depgraph.setdefault(pypungi.pkgtable.packageKey(po), []).append(
+                pypungi.pkgtable.packageKey(dep))
+        if self.trace is not None:
+            if po.arch == 'src':
+                self.trace.addEdge(po, req, dep, 'buildreq')
+            else:
+                self.trace.addEdge(po, req, dep, 'dep')
+
+    def resolveDepClosure(self, pos):
+        """Resolve the dependency closure of the given package objects.
+
+           Packages are processed from a single work queue and each package
+           is visited at most once per run, so repeated calls only do work
+           for packages that have not been seen before.
+
+           Returns a list of the package objects visited by this call (the
+           given packages plus everything newly pulled in), in the order
+           they were processed."""
+
+        queue = collections.deque()
+        closure = []
+
+        def enqueue(po):
+            if po not in self.visited_pos:
+                self.visited_pos.add(po)
+                queue.append(po)
+
+        for po in pos:
+            enqueue(po)
+
+        while queue:
+            po = queue.popleft()
+            closure.append(po)
+            for dep in self.getPackageDeps(po):
+                enqueue(dep)
+
+            # Comps conditionals are added to the transaction by yum itself
+            # when their trigger package goes in, so follow them from the
+            # trigger rather than rescanning tsInfo.
+            for cond in self.ayum.tsInfo.conditionals.get(po.name, ()):
+                if cond not in self.visited_pos and self.ayum.tsInfo.exists(cond.pkgtup):
+                    if self.trace is not None:
+                        self.trace.addEdge(po, 'conditional', cond, 'group')
+                    enqueue(cond)
+
+        return closure
+
+    def _mergedComps(self):
+        """Return the comps xml merged from all repos."""
+
+        if self.compsxml is None:
+            self.compsxml = self.ayum.comps.xml()
+        return self.compsxml
+
+    def getCompsExpansion(self):
+        """Return the comps expansion for the current comps and sack,
+           reusing one from the cachedir if an earlier run worked it out for
+           the same merged comps, repo metadata and arch."""
+
+        if self.compsexpansion is not None:
+            return self.compsexpansion
+
+        compsdigest = hashlib.sha256(self._mergedComps()).hexdigest()
+        key = [compsdigest, self._repomdChecksums(), self.ayum.compatarch,
+               sorted(self.ayum.conf.exclude)]
+        for repo in self.ayum.repos.listEnabled():
+            key.append((repo.id, repo.exclude, repo.includepkgs))
+
+        cachedir = os.path.join(self.config.get('pungi', 'cachedir'), 'comps')
+        pypungi.util._ensuredir(cachedir, self.logger, force=True)
+        path = os.path.join(cachedir, '%s.pickle' % hashlib.sha256(repr(key)).hexdigest())
+
+        groups = None
+        targets = {}
+        cached = pypungi.util._readPickle(path)
+        if cached is not None:
+            groups = cached['groups']
+            for (name, entries) in cached['targets'].iteritems():
+                pos = self._posFromCache(entries)
+                if pos is None:
+                    groups = None
+                    break
+                targets[name] = pos
+
+        if groups is None:
+            self.logger.info('Expanding comps groups (comps digest %s)' % compsdigest)
+            groups = pypungi.comps.groupPackages(self.ayum.comps)
+            targets = {}
+            for name in pypungi.comps.conditionalNames(groups):
+                pkgs = self.ayum.pkgSack.searchNevra(name=name)
+                if pkgs:
+                    pkgs = self.ayum.bestPackagesFromList(pkgs, arch=self.ayum.compatarch)
+                targets[name] = pkgs
+
+            cached = {'groups': groups, 'targets': {}}
+            for (name, pkgs) in targets.iteritems():
+                cached['targets'][name] = [(po.repoid, po.pkgtup) for po in pkgs]
+            pypungi.util._writePickle(path, cached)
+        else:
+            self.logger.info('Reusing comps expansion %s' % path)
+
+        self.compsexpansion = pypungi.comps.CompsExpansion(
+            groups, pypungi.comps.groupAliases(self.ayum.comps), targets)
+        return self.compsexpansion
 
     def getPackagesFromGroup(self, group):
         """Get a list of package names from a ksparser group object
 
             Returns a list of package names"""
 
-        packages = []
+        expansion = self.getCompsExpansion()
 
         # Check if we have the group
-        if not self.ayum.comps.has_group(group.name):
+        if not expansion.hasGroup(group.name):
             self.logger.error("Group %s not found in comps!" % group)
-            return packages
-
-        # Get the group object to work with
-        groupobj = self.ayum.comps.return_group(group.name)
-
-        # Add the mandatory packages
-        packages.extend(groupobj.mandatory_packages.keys())
-
-        # Add the default packages unless we don't want them
-        if group.include == 1:
-            packages.extend(groupobj.default_packages.keys())
+            return []
 
-        # Add the optional packages if we want them
-        if group.include == 2:
-            packages.extend(groupobj.default_packages.keys())
-            packages.extend(groupobj.optional_packages.keys())
+        (packages, conditionals) = expansion.expand([group.name], group.include)
 
         # Deal with conditional packages
         # Populate a dict with the name of the required package and value
         # of the package objects it would bring in.  To be used later if
         # we match the conditional.
-        for condreq, cond in groupobj.conditional_packages.iteritems():
-            pkgs = self.ayum.pkgSack.searchNevra(name=condreq)
-            if pkgs:
-                pkgs = self.ayum.bestPackagesFromList(pkgs, arch=self.ayum.compatarch)
+        for (cond, pkgs) in conditionals:
             if self.ayum.tsInfo.conditionals.has_key(cond):
                 self.ayum.tsInfo.conditionals[cond].extend(pkgs)
             else:
-                self.ayum.tsInfo.conditionals[cond] = pkgs
+                self.ayum.tsInfo.conditionals[cond] = list(pkgs)
+            for po in pkgs:
+                self.conditionalindex.setdefault(po, set()).add(cond)
 
         return packages
 
+    def _getSqlSack(self):
+        """Return a SqlSack over the enabled repos, or None if some repo
+           has no primary database to query (and we have to go through the
+           yum sack).  Requires yum still configured."""
+
+        if self.sqlsack is None:
+            self.sqlsack = False
+            repos = self.ayum.repos.listEnabled()
+            for repo in repos:
+                if not hasattr(repo.sack, 'primarydb') or not repo.sack.primarydb.has_key(repo):
+                    self.logger.info('No primary database for %s, searching the whole sack' % repo.id)
+                    break
+            else:
+                self.sqlsack = pypungi.sqlsack.SqlSack(repos, self.arches)
+        return self.sqlsack or None
+
+    def _matchPackages(self, patterns):
+        """Match package names and globs against the sack.  Returns a
+           (matched, unmatched) tuple like PackageMatcher.match()."""
+
+        matcher = pypungi.matcher.PackageMatcher(patterns)
+        sqlsack = self._getSqlSack()
+        if sqlsack is None:
+            return matcher.match(self.getNameIndex())
+
+        (names, prefixes, everything) = matcher.candidates()
+        return matcher.match(sqlsack.nameIndex(names, prefixes, everything))
+
+    def getNameIndex(self):
+        """Return a dict of package name -> package objects for the whole
+           sack, building it on first use.  Requires yum still configured
+           and excludes already applied."""
+
+        if self.nameindex is None:
+            self.nameindex = pypungi.matcher.buildNameIndex(self.ayum.pkgSack.returnPackages())
+        return self.nameindex
+
     def _addDefaultGroups(self):
         """Cycle through the groups and return at list of the ones that ara
            default."""
@@ -346,38 +872,42 @@ class Pungi(pypungi.PungiBase):
 
     def _deselectPackage(self, pkg, *args):
         """Stolen from anaconda; Remove a package from the transaction set"""
-        sp = pkg.rsplit(".", 2)
-        txmbrs = []
-        if len(sp) == 2:
-            txmbrs = self.ayum.tsInfo.matchNaevr(name=sp[0], arch=sp[1])
-
-        if len(txmbrs) == 0:
-            exact, match, unmatch = yum.packages.parsePackages(self.ayum.pkgSack.returnPackages(), [pkg], casematch=1)
-            for p in exact + match:
-                txmbrs.append(p)
-
-        if len(txmbrs) > 0:
-            for x in txmbrs:
-                self.ayum.tsInfo.remove(x.pkgtup)
-                # we also need to remove from the conditionals
-                # dict so that things don't get pulled back in as a result
-                # of them.  yes, this is ugly.  conditionals should die.
-                for req, pkgs in self.ayum.tsInfo.conditionals.iteritems():
-                    if x in pkgs:
-                        pkgs.remove(x)
-                        self.ayum.tsInfo.conditionals[req] = pkgs
-            return len(txmbrs)
-        else:
-            self.logger.debug("no such package %s to remove" %(pkg,))
+
+        return self._deselectPackages([pkg])
+
+    def _deselectPackages(self, patterns):
+        """Remove every package matching any of patterns from the
+           transaction set in one sweep.  Returns the number of package
+           objects matched."""
+
+        if not patterns:
             return 0
 
+        (matched, unmatched) = self._matchPackages(patterns)
+        for pkg in unmatched:
+            self.logger.debug("no such package %s to remove" % (pkg,))
+
+        excluded = set(matched)
+        affected = set()
+        for po in matched:
+            self.ayum.tsInfo.remove(po.pkgtup)
+            affected.update(self.conditionalindex.pop(po, ()))
+
+        # we also need to remove from the conditionals dict so that things
+        # don't get pulled back in as a result of them.  yes, this is ugly.
+        # conditionals should die.
+        for req in affected:
+            self.ayum.tsInfo.conditionals[req] = [
+                x for x in self.ayum.tsInfo.conditionals[req] if x not in excluded]
+
+        return len(matched)
+
     def getPackageObjects(self):
         """Cycle through the list of packages, get package object
            matches, and resolve deps.
 
            Returns a list of package objects"""
 
-        final_pkgobjs = {} # The final list of package objects
         matchdict = {} # A dict of objects to names
 
         # First remove the excludes
@@ -405,14 +935,9 @@ class Pungi(pypungi.PungiBase):
         for pkg in self.ksparser.handler.packages.packageList:
             searchlist[pkg] = "kickstart_file"
 
-        # Make the search list unique
-        searchlistUnique = yum.misc.unique(searchlist.keys())
-
-        allPackages = self.ayum.pkgSack.returnPackages()
-
         # Search repos for things in our searchlist, supports globs
-        (exactmatched, matched, unmatched) = yum.packages.parsePackages(allPackages, searchlistUnique, casematch=1)
-        matches = filter(self._filtersrcdebug, exactmatched + matched)
+        (matches, unmatched) = self._matchPackages(searchlist.keys())
+        matches = filter(self._filtersrcdebug, matches)
 
         # Populate a dict of package objects to their names
         for match in matches:
@@ -420,13 +945,28 @@ class Pungi(pypungi.PungiBase):
 
         # Get the newest results from the search
         mysack = yum.packageSack.ListPackageSack(matches)
+        seeds = {}
         for match in mysack.returnNewestByNameArch():
             self.ayum.tsInfo.addInstall(match)
             self.logger.debug('Found %s.%s' % (match.name, match.arch))
+            if self.trace is not None:
+                self._traceMatch(match, searchlist)
+            source = searchlist.get(match.name, 'kickstart_file')
+            if source != 'kickstart_file':
+                source = '@%s' % source.name
+            seeds.setdefault(source, []).append(pypungi.pkgtable.packageKey(match))
+
+        # Remember what the groups selected, in kickstart order, for ordering
+        # the packages on split media.
+        self.orderseeds = []
+        for source in ['@%s' % group.name for group in self.ksparser.handler.packages.groupList] + \
+                      ['kickstart_file']:
+            if seeds.has_key(source):
+                self.orderseeds.append((source, seeds.pop(source)))
 
         # raise an exception if there is an unmatched non-ignored package
         for pkg in unmatched:
-            if (pkg not in matchdict.keys()) and (pkg not in self.ksparser.handler.packages.excludedList):
+            if (not matchdict.has_key(pkg)) and (pkg not in self.ksparser.handler.packages.excludedList):
                 raise exceptions.MissingPackageError('Could not find a match for %r in any configured repo (source requirement: %s)' % (
                     pkg, searchlist.get(pkg),
                 ))
@@ -436,154 +976,441 @@ class Pungi(pypungi.PungiBase):
             raise exceptions.MissingPackageError('No packages found to download.')
 
         # Deselect things we don't want from the ks
-        map(self._deselectPackage, self.ksparser.handler.packages.excludedList)
-
-        moretoprocess = True
-        while moretoprocess: # Our fun loop
-            moretoprocess = False
-            for txmbr in self.ayum.tsInfo:
-                if not final_pkgobjs.has_key(txmbr.po):
-                    final_pkgobjs[txmbr.po] = None # Add the pkg to our final list
-                    self.getPackageDeps(txmbr.po) # Get the deps of our package
-                    moretoprocess = True
-
-        self.polist = final_pkgobjs.keys()
+        self._deselectPackages(self.ksparser.handler.packages.excludedList)
+
+        self.polist.extend(self.resolveDepClosure([txmbr.po for txmbr in self.ayum.tsInfo]))
         self.logger.info('Finished gathering package objects.')
 
+    def _traceMatch(self, po, searchlist):
+        """Record which kickstart entry or comps group selected po."""
+
+        pattern = None
+        if searchlist.has_key(po.name):
+            pattern = po.name
+        else:
+            keys = pypungi.matcher.packageKeys(po)
+            for candidate in sorted(searchlist.keys()):
+                if candidate in keys or fnmatch.filter(keys, candidate):
+                    pattern = candidate
+                    break
+        if pattern is None:
+            return
+
+        source = searchlist[pattern]
+        if source == 'kickstart_file':
+            self.trace.addEdge('kickstart', pattern, po, 'kickstart')
+        else:
+            self.trace.addEdge('@%s' % source.name, pattern, po, 'group')
+
     def getSRPMPo(self, po):
         """Given a package object, get a package object for the
-           corresponding source rpm. Requires yum still configured
-           and a valid package object."""
-        srpm = po.sourcerpm.split('.src.rpm')[0]
-        (sname, sver, srel) = srpm.rsplit('-', 2)
-        try:
-            srpmpo = self.ayum.pkgSack.searchNevra(name=sname, ver=sver, rel=srel, arch='src')[0]
-            return srpmpo
-        except IndexError:
-            print >> sys.stderr, "Error: Cannot find a source rpm for %s" % srpm
-            sys.exit(1)
+           corresponding source rpm, or None if there is none. Requires yum
+           still configured and a valid package object."""
+
+        return self.getSourceIndex().sourceFor(po)
 
     def createSourceHashes(self):
-        """Create two dicts - one that maps binary POs to source POs, and
-           one that maps a single source PO to all binary POs it produces.
-           Requires yum still configured."""
-        self.src_by_bin = {}
-        self.bin_by_src = {}
-        self.logger.info("Generating source <-> binary package mappings")
-        (dummy1, everything, dummy2) = yum.packages.parsePackages(self.ayum.pkgSack.returnPackages(), ['*'])
-        for po in everything:
-            if po.arch == 'src':
-                continue
-            srpmpo = self.getSRPMPo(po)
-            self.src_by_bin[po] = srpmpo
-            if self.bin_by_src.has_key(srpmpo):
-                self.bin_by_src[srpmpo].append(po)
-            else:
-                self.bin_by_src[srpmpo] = [po]
+        """Build the source <-> binary package index in one pass over the
+           sack, or use the sqlite sack, which answers the same questions
+           with queries.  Requires yum still configured."""
+
+        self.sourceindex = self._getSqlSack()
+        if self.sourceindex is None:
+            self.logger.info("Generating source <-> binary package mappings")
+            self.sourceindex = pypungi.sourceindex.SourceIndex(self.ayum.pkgSack.returnPackages())
+
+    def getSourceIndex(self):
+        """Return the source <-> binary package index, building it on first
+           use so that composes without sources never pay for it."""
+
+        if self.sourceindex is None:
+            self.createSourceHashes()
+        return self.sourceindex
 
     def getSRPMList(self):
         """Cycle through the list of package objects and
            find the sourcerpm for them.  Requires yum still
            configured and a list of package objects"""
+        sourceindex = self.getSourceIndex()
+        missing = []
         for po in self.polist[self.last_po:]:
-            srpmpo = self.src_by_bin[po]
+            srpmpo = sourceindex.sourceFor(po)
+            if srpmpo is None:
+                missing.append('%s (for %s.%s)' % (po.sourcerpm, po.name, po.arch))
+                continue
             if not srpmpo in self.srpmpolist:
                 self.logger.info("Adding source package %s.%s" % (srpmpo.name, srpmpo.arch))
                 self.srpmpolist.append(srpmpo)
+                if self.trace is not None:
+                    self.trace.addEdge(po, po.sourcerpm, srpmpo, 'source')
         self.last_po = len(self.polist)
 
+        if missing:
+            missing.sort()
+            for srpm in missing:
+                self.logger.error("Cannot find a source rpm for %s" % srpm)
+            raise exceptions.MissingPackageError('Cannot find source rpms for %d packages: %s' % (
+                len(missing), ', '.join(missing)))
+
+    def _addToPolist(self, seeds, kind, counts):
+        """Add the dependency closure of seeds to polist, counting the
+           seeds themselves under kind and everything they pull in as
+           runtime dependencies."""
+
+        seedset = set(seeds)
+        for po in self.resolveDepClosure(seeds):
+            if po.arch == 'src':
+                continue
+            self.polist.append(po)
+            if po in seedset:
+                counts[kind] += 1
+            else:
+                counts['dep'] += 1
+
+    def resolveSourceClosure(self, buildreqs=False, fulltree=False):
+        """Grow the package set until it is closed under runtime
+           requirements and, optionally, build requirements of the included
+           source rpms (buildreqs) and the other binaries built from them
+           (fulltree).  All three kinds of edges are followed from one work
+           queue of source rpms, so each source rpm is expanded only once.
+           Requires yum still configured, a list of package objects, and a
+           list of source rpms.
+
+           Returns a dict of how many packages each kind of edge added."""
+
+        counts = {'dep': 0, 'buildreq': 0, 'fulltree': 0}
+        sourceindex = self.getSourceIndex()
+
+        self.getSRPMList()
+        pending = collections.deque(self.srpmpolist)
+        while pending:
+            srpm = pending.popleft()
+
+            if buildreqs and srpm not in self.srpms_build:
+                self.srpms_build.add(srpm)
+                self._addToPolist(self.getPackageDeps(self.srpmpolist.packageObject(srpm)),
+                                  'buildreq', counts)
+
+            if fulltree and srpm not in self.srpms_fulltree:
+                self.srpms_fulltree.add(srpm)
+                siblings = []
+                for po in sourceindex.binariesFor(srpm):
+                    # Everything already walked by the closure is in polist.
+                    if po not in self.visited_pos and 'debuginfo' not in po.name:
+                        self.logger.info("Adding %s.%s to complete package set" % (po.name, po.arch))
+                        siblings.append(po)
+                        if self.trace is not None:
+                            self.trace.addEdge(srpm, 'fulltree', po, 'fulltree')
+                self._addToPolist(siblings, 'fulltree', counts)
+
+            # Queue up the sources of whatever we just added
+            known = len(self.srpmpolist)
+            self.getSRPMList()
+            pending.extend(self.srpmpolist[known:])
+
+        self.logger.info("Source closure added %d packages as build requirements, "
+                         "%d to complete source rpms and %d as their dependencies" % (
+                         counts['buildreq'], counts['fulltree'], counts['dep']))
+        return counts
+
     def resolvePackageBuildDeps(self):
         """Make the package lists self hosting. Requires yum
            still configured, a list of package objects, and a
            a list of source rpms."""
-        deppass = 1
-        while 1:
-            self.logger.info("Resolving build dependencies, pass %d" % (deppass))
-            prev = list(self.ayum.tsInfo.getMembers())
-            for srpm in self.srpmpolist[len(self.srpms_build):]:
-                self.getPackageDeps(srpm)
-            for txmbr in self.ayum.tsInfo:
-                if txmbr.po.arch != 'src' and txmbr.po not in self.polist:
-                    self.polist.append(txmbr.po)
-                    self.getPackageDeps(txmbr.po)
-            self.srpms_build = list(self.srpmpolist)
-            # Now that we've resolved deps, refresh the source rpm list
-            self.getSRPMList()
-            deppass = deppass + 1
-            if len(prev) == len(self.ayum.tsInfo.getMembers()):
-                break
+
+        self.logger.info("Resolving build dependencies")
+        return self.resolveSourceClosure(buildreqs=True)
 
     def completePackageSet(self):
-        """Cycle through all package objects, and add any
-           that correspond to a source rpm that we are including.
-           Requires yum still configured and a list of package
-           objects."""
-        thepass = 1
-        while 1:
-            prevlen = len(self.srpmpolist)
-            self.logger.info("Completing package set, pass %d" % (thepass,))
-            for srpm in self.srpmpolist[len(self.srpms_fulltree):]:
-                for po in self.bin_by_src[srpm]:
-                    if po not in self.polist and 'debuginfo' not in po.name:
-                        self.logger.info("Adding %s.%s to complete package set" % (po.name, po.arch))
-                        self.polist.append(po)
-                        self.getPackageDeps(po)
-            for txmbr in self.ayum.tsInfo:
-                if txmbr.po.arch != 'src' and txmbr.po not in self.polist:
-                    self.polist.append(txmbr.po)
-                    self.getPackageDeps(po)
-            self.srpms_fulltree = list(self.srpmpolist)
-            # Now that we've resolved deps, refresh the source rpm list
-            self.getSRPMList()
-            if len(self.srpmpolist) == prevlen:
-                self.logger.info("Completion finished in %d passes" % (thepass,))
-                break
-            thepass = thepass + 1
+        """Add any package objects that correspond to a source rpm that we
+           are including. Requires yum still configured and a list of
+           package objects."""
+
+        self.logger.info("Completing package set")
+        return self.resolveSourceClosure(fulltree=True)
 
     def getDebuginfoList(self):
-        """Cycle through the list of package objects and find
-           debuginfo rpms for them.  Requires yum still
-           configured and a list of package objects"""
+        """Find the debuginfo rpms for the list of package objects in one
+           batch.  Requires yum still configured and a list of package
+           objects"""
 
-        for po in self.polist:
-            debugname = '%s-debuginfo' % po.name
-            results = self.ayum.pkgSack.searchNevra(name=debugname,
-                                                    epoch=po.epoch,
-                                                    ver=po.version,
-                                                    rel=po.release,
-                                                    arch=po.arch)
-            if results:
-                if not results[0] in self.debuginfolist:
-                    self.logger.debug('Added %s found by name' % results[0].name)
-                    self.debuginfolist.append(results[0])
-            else:
-                srpm = po.sourcerpm.split('.src.rpm')[0]
-                sname, sver, srel = srpm.rsplit('-', 2)
-                debugname = '%s-debuginfo' % sname
-                srcresults = self.ayum.pkgSack.searchNevra(name=debugname,
-                                                           ver=sver,
-                                                           rel=srel,
-                                                           arch=po.arch)
-                if srcresults:
-                    if not srcresults[0] in self.debuginfolist:
-                        self.logger.debug('Added %s found by srpm' % srcresults[0].name)
-                        self.debuginfolist.append(srcresults[0])
-
-            if po.name == 'kernel' or po.name == 'glibc':
-                debugcommon = '%s-debuginfo-common' % po.name
-                commonresults = self.ayum.pkgSack.searchNevra(name=debugcommon,
-                                                              epoch=po.epoch,
-                                                              ver=po.version,
-                                                              rel=po.release,
-                                                              arch=po.arch)
-                if commonresults:
-                    if not commonresults[0] in self.debuginfolist:
-                        self.logger.debug('Added %s found by common' % commonresults[0].name)
-                        self.debuginfolist.append(commonresults[0])
-
-    def _downloadPackageList(self, polist, relpkgdir):
-        """Cycle through the list of package objects and
-           download them from their respective repos."""
+        sqlsack = self._getSqlSack()
+        if sqlsack is not None:
+            debugindex = sqlsack.debuginfoIndex(self.polist)
+        else:
+            self.logger.info("Indexing debuginfo packages")
+            debugindex = pypungi.debuginfo.DebuginfoIndex(self.ayum.pkgSack.returnPackages())
+        self.debuginfolist.extend(debugindex.resolve(self.polist))
+
+        if self.trace is not None:
+            for (po, debugpo, how) in debugindex.resolvePairs(self.polist):
+                self.trace.addEdge(po, how, debugpo, 'debuginfo')
+
+    def _packagesDigest(self):
+        """Return a digest of the kickstart %packages section which does not
+           depend on the order or repetition of its entries."""
+
+        packages = self.ksparser.handler.packages
+
+        groups = yum.misc.unique(['%s:%s' % (group.name, group.include) for group in packages.groupList])
+        groups.sort()
+        adds = yum.misc.unique(packages.packageList)
+        adds.sort()
+        excludes = yum.misc.unique(packages.excludedList)
+        excludes.sort()
+
+        return hashlib.sha256(repr((groups, adds, excludes,
+                                    bool(packages.default), bool(packages.addBase)))).hexdigest()
+
+    def _gatherCachePath(self):
+        """Return the path of the gather cache entry for this compose.  The
+           key is worked out on first use, before gather adds its own groups
+           to the kickstart."""
+
+        if not self.gathercachepath:
+            key = [self._repomdChecksums(), self._packagesDigest(), self.config.get('pungi', 'arch'),
+                   sorted(self.ayum.conf.exclude)]
+            for repo in self.ayum.repos.listEnabled():
+                key.append((repo.id, repo.exclude, repo.includepkgs))
+            for flag in ('selfhosting', 'fulltree', 'debuginfo', 'source'):
+                key.append((flag, self.config.getboolean('pungi', flag)))
+
+            cachedir = os.path.join(self.config.get('pungi', 'cachedir'), 'gather')
+            pypungi.util._ensuredir(cachedir, self.logger, force=True)
+            self.gathercachepath = os.path.join(cachedir, '%s.pickle' % hashlib.sha256(repr(key)).hexdigest())
+
+        return self.gathercachepath
+
+    def _posFromCache(self, entries):
+        """Map cached (repo id, pkgtup) pairs back to package objects.
+           Returns None if any of them is no longer in the sack."""
+
+        pos = []
+        for (repoid, pkgtup) in entries:
+            po = self._findPackage(repoid, pkgtup)
+            if po is None:
+                self.logger.info('Cached package %s from %s is gone' % ('-'.join(pkgtup), repoid))
+                return None
+            pos.append(po)
+        return pos
+
+    def loadGatherCache(self):
+        """Restore polist, srpmpolist and debuginfolist from an earlier
+           gather of the same kickstart against the same repo metadata.
+           Requires yum still configured.
+
+           Returns True if the gather result was restored."""
+
+        path = self._gatherCachePath()
+        cached = pypungi.util._readPickle(path)
+        if cached is None:
+            self.logger.info('Gather cache miss: %s' % path)
+            return False
+
+        lists = []
+        for name in ('polist', 'srpmpolist', 'debuginfolist'):
+            pos = self._posFromCache(cached[name])
+            if pos is None:
+                self.logger.info('Gather cache entry %s is stale' % path)
+                return False
+            lists.append(pos)
+
+        (self.polist, self.srpmpolist, self.debuginfolist) = [
+            pypungi.pkgtable.PackageTable(self._lookupPackage, pos) for pos in lists]
+        self.depgraph = cached.get('depgraph', {})
+        self.orderseeds = cached.get('orderseeds', [])
+        self.logger.info('Gather cache hit: %s (%d packages, %d source, %d debuginfo)' % (
+            path, len(self.polist), len(self.srpmpolist), len(self.debuginfolist)))
+        return True
+
+    def saveGatherCache(self):
+        """Store the gathered package lists for loadGatherCache()."""
+
+        cached = {}
+        for name in ('polist', 'srpmpolist', 'debuginfolist'):
+            cached[name] = [(po.repoid, po.pkgtup) for po in getattr(self, name)]
+        cached['depgraph'] = self.depgraph
+        cached['orderseeds'] = self.orderseeds
+
+        pypungi.util._writePickle(self._gatherCachePath(), cached)
+        self.logger.info('Saved gather result to %s' % self._gatherCachePath())
+
+    def gather(self):
+        """Work out polist, srpmpolist and debuginfolist for the kickstart,
+           following the source, selfhosting, fulltree and debuginfo config
+           flags.  Reuses the gather cache when it can."""
+
+        # Work out the cache key now, before gather adds its own groups to
+        # the kickstart
+        self._gatherCachePath()
+
+        # A cached result has no trace to go with it
+        if self.trace is None and self.loadGatherCache():
+            self._releaseGather()
+            return
+
+        source = self.config.getboolean('pungi', 'source')
+        selfhosting = self.config.getboolean('pungi', 'selfhosting')
+        fulltree = self.config.getboolean('pungi', 'fulltree')
+
+        self.getPackageObjects()
+        if source or selfhosting or fulltree:
+            self.getSRPMList()
+        if selfhosting or fulltree:
+            self.resolveSourceClosure(buildreqs=selfhosting, fulltree=fulltree)
+        if self.config.getboolean('pungi', 'debuginfo'):
+            self.getDebuginfoList()
+        self.saveGatherCache()
+
+        if self.trace is not None:
+            self.trace.write(self.tracepath)
+            self.logger.info('Wrote depsolve trace of %d edges to %s' % (
+                len(self.trace.edges), self.tracepath))
+
+        self._releaseGather()
+
+    def _releaseGather(self):
+        """Drop the package objects gather held on to.  The package tables
+           keep only their entries and look package objects up again when
+           asked for them."""
+
+        for pkgtable in (self.polist, self.srpmpolist, self.debuginfolist):
+            pkgtable.detach()
+        self.visited_pos = set()
+        self.resolved_deps = {}
+        self.conditionalindex = {}
+        self.sourceindex = None
+        self.nameindex = None
+        self.sqlsack = None
+        del self.ayum.tsInfo
+
+    def _packageUrls(self, po):
+        """Return the urls a package can be fetched from, one per mirror,
+           or None if it has to be left to yum (proxies, non-http repos)."""
+
+        if po.repo.proxy:
+            return None
+        if po.basepath:
+            baseurls = [po.basepath]
+        else:
+            baseurls = po.repo.urls
+
+        urls = []
+        for baseurl in baseurls:
+            if urlparse.urlsplit(baseurl)[0] not in ('http', 'https'):
+                return None
+            urls.append('%s/%s' % (baseurl.rstrip('/'), po.relativepath.lstrip('/')))
+        return urls or None
+
+    def _getPool(self):
+        """Return the package pool in the cachedir."""
+
+        if self.pool is None:
+            self.pool = pypungi.pool.PackagePool(
+                os.path.join(self.config.get('pungi', 'cachedir'), 'pool'))
+        return self.pool
+
+    def _poolPackage(self, po):
+        """Move a verified package from the yum cache into the pool.
+           Packages of local file repos are left where they are."""
+
+        local = po.localPkg()
+        cachedir = os.path.realpath(self.config.get('pungi', 'cachedir'))
+        if not os.path.realpath(local).startswith(cachedir + os.sep):
+            return
+        (checksum_type, checksum) = po.returnIdSum()
+        self.poolpaths[pypungi.pkgtable.packageKey(po)] = \
+            self._getPool().add(local, checksum_type, checksum, remove=True)
+
+    def gcPool(self):
+        """Trim the pool to the poolsize config option (in MiB, 0 for no
+           limit), dropping the least recently used packages."""
+
+        maxbytes = int(self.config.getfloat('pungi', 'poolsize') * 1024 * 1024)
+        if not maxbytes:
+            return
+        (removed, freed) = self._getPool().gc(maxbytes)
+        if removed:
+            self.logger.info('Removed %d packages (%d MiB) from the pool' % (
+                removed, freed / (1024 * 1024)))
+
+    def _fetchPackages(self, polist):
+        """Make sure the packages in polist are in the pool (or in a local
+           file repo), fetching the ones from http repos with a parallel
+           downloader and leaving the rest to yum."""
+
+        downloads = []
+        viayum = []
+        fetched = []
+        for po in polist:
+            key = pypungi.pkgtable.packageKey(po)
+            if self.poolpaths.has_key(key):
+                continue
+            pooled = self._getPool().lookup(*po.returnIdSum())
+            if pooled is not None:
+                if self.verifyCachePkg(po, pooled):
+                    self.poolpaths[key] = pooled
+                    continue
+                self.logger.warning('Dropping corrupt %s from the pool' % pooled)
+                self._getPool().remove(*po.returnIdSum())
+            local = po.localPkg()
+            if os.path.exists(local) and self.verifyCachePkg(po, local):
+                self._poolPackage(po)
+                continue
+            fetched.append(po)
+            urls = self._packageUrls(po)
+            if urls is None:
+                viayum.append(po)
+                continue
+            pypungi.util._ensuredir(os.path.dirname(local), self.logger, force=True)
+            (checksum_type, checksum) = po.returnIdSum()
+            downloads.append((pypungi.download.Download(urls, local, int(po.size),
+                                                        checksum_type, checksum), po))
+
+        self.logger.info('Downloading %d packages, %d of them through yum' % (
+            len(downloads) + len(viayum), len(viayum)))
+
+        probs = {}
+        if downloads:
+            # Partial downloads are kept in the cachedir, so they resume
+            # after a failed attempt, or in the next run
+            partialdir = os.path.join(self.config.get('pungi', 'cachedir'), 'partial')
+            pypungi.util._ensuredir(partialdir, self.logger, force=True)
+            downloader = pypungi.download.Downloader(self.logger,
+                perhost=self.config.getint('pungi', 'downloadworkers'),
+                partialdir=partialdir,
+                retries=self.config.getint('pungi', 'downloadretries'))
+            failed = downloader.run([download for (download, po) in downloads])
+            for (download, po) in downloads:
+                if failed.has_key(download):
+                    probs[po] = failed[download]
+        if viayum:
+            probs.update(self.ayum.downloadPkgs(viayum))
+
+        # Downloads were verified as they came in, so they need not be read
+        # again next time
+        for po in fetched:
+            if probs.has_key(po):
+                continue
+            (checksum_type, checksum) = po.returnIdSum()
+            self._getChecksumMemo().remember(po.localPkg(), checksum_type, checksum)
+            self._poolPackage(po)
+        self._getPool().commit()
+        self._closeChecksumMemo()
+
+        if len(probs.keys()) > 0:
+            self.logger.error("Errors were encountered while downloading packages.")
+            for key in probs.keys():
+                errors = yum.misc.unique(probs[key])
+                for error in errors:
+                    self.logger.error("%s: %s" % (key, error))
+            self.logger.error("Run again to resume the downloads that did not finish.")
+            sys.exit(1)
+
+    def _linkPackageList(self, pkgtable, relpkgdir):
+        """Link a table of packages from the pool into the tree."""
+
+        polist = pkgtable.packageObjects()
 
         downloads = []
         for pkg in polist:
@@ -603,32 +1430,59 @@ class Pungi(pypungi.PungiBase):
         else:
             pypungi.util._ensuredir(pkgdir, self.logger, force=self.config.getboolean('pungi', 'force'), clean=True)
 
-        probs = self.ayum.downloadPkgs(polist)
-
-        if len(probs.keys()) > 0:
-            self.logger.error("Errors were encountered while downloading packages.")
-            for key in probs.keys():
-                errors = yum.misc.unique(probs[key])
-                for error in errors:
-                    self.logger.error("%s: %s" % (key, error))
-            sys.exit(1)
-
         for po in polist:
             basename = os.path.basename(po.relativepath)
 
-            local = po.localPkg()
+            local = self.poolpaths.get(pypungi.pkgtable.packageKey(po), po.localPkg())
             target = os.path.join(pkgdir, basename)
 
-            # Link downloaded package in (or link package from file repo)
+            # Link pooled package in (or link package from file repo)
             try:
                 pypungi.util._link(local, target, self.logger, force=True)
                 continue
             except:
-                self.logger.error("Unable to link %s from the yum cache." % po.name)
+                self.logger.error("Unable to link %s from the pool." % po.name)
                 sys.exit(1)
 
         self.logger.info('Finished downloading packages.')
 
+    def _downloadPackageList(self, pkgtable, relpkgdir):
+        """Cycle through a table of packages and
+           download them from their respective repos."""
+
+        self._fetchPackages(pkgtable.packageObjects())
+        self._linkPackageList(pkgtable, relpkgdir)
+        self.gcPool()
+
+    def _treeLists(self):
+        """Return (package table, tree dir) for every tree gather fills:
+           os, and debug and SRPMS unless turned off."""
+
+        trees = [(self.polist, os.path.join(self.config.get('pungi', 'arch'),
+                                            self.config.get('pungi', 'osdir'),
+                                            self.config.get('pungi', 'product_path')))]
+        if self.config.getboolean('pungi', 'debuginfo'):
+            trees.append((self.debuginfolist, os.path.join(self.config.get('pungi', 'arch'),
+                                                           'debug')))
+        if self.config.getboolean('pungi', 'source'):
+            trees.append((self.srpmpolist, os.path.join('source', 'SRPMS')))
+        return trees
+
+    def downloadTrees(self):
+        """Download the packages of every tree as one queue, then link each
+           tree.  Does what downloadPackages(), downloadDebuginfo() and
+           downloadSRPMs() do one after the other."""
+
+        trees = self._treeLists()
+        polist = []
+        for (pkgtable, relpkgdir) in trees:
+            polist.extend(pkgtable.packageObjects())
+        self._fetchPackages(polist)
+        for (pkgtable, relpkgdir) in trees:
+            self._linkPackageList(pkgtable, relpkgdir)
+        pypungi.util._materializeStats(self.logger, 'Put the trees in place')
+        self.gcPool()
+
     def downloadPackages(self):
         """Download the package objects obtained in getPackageObjects()."""
 
@@ -644,7 +1498,7 @@ class Pungi(pypungi.PungiBase):
 
         ourcomps = open(ourcompspath, 'w')
 
-        ourcomps.write(self.ayum.comps.xml())
+        ourcomps.write(self._mergedComps())
 
         ourcomps.close()
 
@@ -673,6 +1527,71 @@ class Pungi(pypungi.PungiBase):
         self._downloadPackageList(self.debuginfolist, os.path.join(self.config.get('pungi', 'arch'),
                                                            'debug'))
 
+    def plan(self):
+        """Report what the compose of the kickstart would hold, from the
+           gathered package lists and the package sizes in the repo metadata,
+           without downloading anything or writing the tree.  Requires
+           gather() to have run.
+
+           Returns a dict with the package count per tree, the download
+           bytes per repo, the bytes already in the cache, the estimated
+           size of the os tree in MiB and the estimated split media."""
+
+        trees = [('os', self.polist), ('debug', self.debuginfolist)]
+        if self.config.getboolean('pungi', 'source'):
+            trees.append(('SRPMS', self.srpmpolist))
+
+        report = {'packages': {}, 'repobytes': {}, 'cachedbytes': 0}
+        for (tree, pkgtable) in trees:
+            report['packages'][tree] = len(pkgtable)
+            for po in pkgtable.packageObjects():
+                report['repobytes'][po.repoid] = report['repobytes'].get(po.repoid, 0) + int(po.size)
+                local = po.localPkg()
+                if self._getPool().contains(*po.returnIdSum()) or \
+                   (os.path.exists(local) and os.path.getsize(local) == int(po.size)):
+                    report['cachedbytes'] += int(po.size)
+
+        # Split the os tree the way doSplittree would, in install order
+        sizes = dict([('%s-%s-%s.%s.rpm' % (po.name, po.version, po.release, po.arch), po.size)
+                      for po in self.polist])
+        timber = pypungi.splittree.Timber()
+        timber.arch = self.config.get('pungi', 'arch')
+        timber.disc_size = self.config.getfloat('pungi', 'cdsize')
+        timber.comps_size = 0
+        discs = timber.planRPMS([(name, sizes[name]) for name in self.getPackageOrder()])
+        report['treesize'] = sum([disc[2] for disc in discs]) / 1024 / 1024
+        report['discs'] = discs
+        if self.config.getboolean('pungi', 'source'):
+            report['srpmdiscs'] = timber.planSRPMS(
+                [(os.path.basename(po.relativepath), po.size) for po in self.srpmpolist])
+
+        for (tree, pkgtable) in trees:
+            self.logger.info('Plan: %s tree: %d packages' % (tree, report['packages'][tree]))
+        for repoid in sorted(report['repobytes'].keys()):
+            self.logger.info('Plan: %d MiB to download from %s' % (
+                report['repobytes'][repoid] / 1024 / 1024, repoid))
+        self.logger.info('Plan: %d MiB already in the cache' % (report['cachedbytes'] / 1024 / 1024))
+        # Same cut off as doCreateIsos, packages only (no installer images)
+        if report['treesize'] > 700:
+            self.logger.info('Plan: %d MiB of packages, a DVD or %d discs of %s MiB' % (
+                report['treesize'], len(discs), self.config.get('pungi', 'cdsize')))
+            for (number, (first, last, size)) in enumerate(discs):
+                self.logger.info('Plan:   disc%d: %d MiB, %s .. %s' % (number + 1, size / 1024 / 1024, first, last))
+        else:
+            self.logger.info('Plan: %d MiB of packages, fits on a CD' % report['treesize'])
+        if report.has_key('srpmdiscs'):
+            self.logger.info('Plan: source rpms on %d discs' % len(report['srpmdiscs']))
+        return report
+
+    def doGather(self):
+        """The whole gather stage: gather, then download everything and
+           write the comps file.  Requires yum to be set up."""
+
+        self.gather()
+        self.downloadTrees()
+        self.makeCompsFile()
+        self.saveSackSnapshot()
+
     def writeinfo(self, line):
         """Append a line to the infofile in self.infofile"""
 
@@ -839,7 +1758,8 @@ class Pungi(pypungi.PungiBase):
                 # don't bother summing directories.  Won't work.
                 if os.path.isdir(path):
                     continue
-                sum = pypungi.util._doCheckSum(path, 'sha256', self.logger)
+                sum = pypungi.util._doCheckSum(path, 'sha256', self.logger,
+                                               self._getChecksumMemo())
                 outpath = path.replace(basepath, '')
                 sums.append((outpath, sum))
 
@@ -852,8 +1772,9 @@ class Pungi(pypungi.PungiBase):
 
         # Get a checksum of repomd.xml since it has within it sums for other files
         repomd = os.path.join(self.topdir, 'repodata', 'repomd.xml')
-        sum = pypungi.util._doCheckSum(repomd, 'sha256', self.logger)
+        sum = pypungi.util._doCheckSum(repomd, 'sha256', self.logger, self._getChecksumMemo())
         sums.append((os.path.join('repodata', 'repomd.xml'), sum))
+        self._closeChecksumMemo()
 
         # Now add the sums, and write the config out
         try:
@@ -868,11 +1789,35 @@ class Pungi(pypungi.PungiBase):
         treeinfo.write(treefile)
         treefile.close()
 
+    def getPackageOrder(self):
+        """Return polist in install order, as the n-v-r.a.rpm names
+           anaconda's pkgorder writes: the packages of the kickstart's groups
+           and their dependencies first, from the gather dependency graph."""
+
+        keys = [pypungi.pkgtable.packageKey(entry) for entry in self.polist]
+        order = pypungi.installorder.installOrder(
+            [seeds for (source, seeds) in self.orderseeds], self.depgraph, keys)
+
+        entries = dict(zip(keys, self.polist))
+        return ['%s-%s-%s.%s.rpm' % (entries[key].name, entries[key].version,
+                                     entries[key].release, entries[key].arch) for key in order]
+
     def doPackageorder(self):
-        """Run anaconda-runtime's pkgorder on the tree, used for splitting media."""
+        """Work out the package order used for splitting media.  Uses the
+           gather dependency graph if this compose has one, otherwise runs
+           anaconda-runtime's pkgorder on the tree."""
+
+        pkgorderpath = os.path.join(self.workdir, 'pkgorder-%s' % self.config.get('pungi', 'arch'))
 
+        if self.orderseeds:
+            self.pkgorder = self.getPackageOrder()
+            pkgorderfile = open(pkgorderpath, 'w')
+            pkgorderfile.write(''.join(['%s\n' % name for name in self.pkgorder]))
+            pkgorderfile.close()
+            self.logger.info('Ordered %d packages from the gather graph' % len(self.pkgorder))
+            return
 
-        pkgorderfile = open(os.path.join(self.workdir, 'pkgorder-%s' % self.config.get('pungi', 'arch')), 'w')
+        pkgorderfile = open(pkgorderpath, 'w')
         # setup the command
         pkgorder = ['/usr/bin/pkgorder']
         #pkgorder.append('TMPDIR=%s' % self.workdir)
@@ -940,18 +1885,22 @@ class Pungi(pypungi.PungiBase):
                 for regex in dirres:
                     if regex.match(directory) and not os.path.exists(os.path.join(self.topdir, directory)):
                         self.logger.info("Copying release note dir %s" % directory)
-                        shutil.copytree(os.path.join(dirpath, directory), os.path.join(self.topdir, directory))
+                        pypungi.util._copyTree(os.path.join(dirpath, directory),
+                                               os.path.join(self.topdir, directory), self.logger)
+
+        pypungi.util._materializeStats(self.logger, 'Put the release notes in place')
 
     def doSplittree(self):
         """Use anaconda-runtime's splittree to split the tree into appropriate
            sized chunks."""
 
 
-        timber = splittree.Timber()
+        timber = pypungi.splittree.Timber()
         timber.arch = self.config.get('pungi', 'arch')
         timber.disc_size = self.config.getfloat('pungi', 'cdsize')
         timber.src_discs = 0
         timber.release_str = '%s %s' % (self.config.get('pungi', 'name'), self.config.get('pungi', 'version'))
+        timber.package_order = self.pkgorder
         timber.package_order_file = os.path.join(self.workdir, 'pkgorder-%s' % self.config.get('pungi', 'arch'))
         timber.dist_dir = self.topdir
         timber.src_dir = os.path.join(self.config.get('pungi', 'destdir'), self.config.get('pungi', 'version'), 'source', 'SRPMS')
@@ -971,7 +1920,7 @@ class Pungi(pypungi.PungiBase):
            sized chunks."""
 
 
-        timber = splittree.Timber()
+        timber = pypungi.splittree.Timber()
         timber.arch = self.config.get('pungi', 'arch')
         timber.target_size = self.config.getfloat('pungi', 'cdsize') * 1024 * 1024
         #timber.total_discs = self.config.getint('pungi', 'discs')
@@ -1043,7 +1992,7 @@ cost=500
             self.logger.error("Could not open checksum file: %s" % csumfile)
 
         self.logger.info("Generating checksum of %s" % path)
-        checksum = pypungi.util._doCheckSum(path, 'sha256', self.logger)
+        checksum = pypungi.util._doCheckSum(path, 'sha256', self.logger, self._getChecksumMemo())
         if checksum:
             checkfile.write("%s *%s\n" % (checksum.replace('sha256:', ''), os.path.basename(path)))
         else:
@@ -1117,7 +2066,8 @@ cost=500
 
             shutil.move(os.path.join(self.topdir, 'repodata'), os.path.join(self.config.get('pungi', 'destdir'),
                 'repodata-%s' % self.config.get('pungi', 'arch')))
-            shutil.copytree('%s-disc1/repodata' % self.topdir, os.path.join(self.topdir, 'repodata'))
+            pypungi.util._copyTree('%s-disc1/repodata' % self.topdir,
+                                   os.path.join(self.topdir, 'repodata'), self.logger)
 
         # setup the extra mkisofs args
         extraargs = []
@@ -1267,4 +2217,6 @@ cost=500
                     shutil.rmtree(os.path.join(self.workdir, directory))
                 shutil.move(os.path.join(self.archdir, directory), os.path.join(self.workdir, directory))
 
+        pypungi.util._materializeStats(self.logger, 'Put the iso files in place')
+        self._closeChecksumMemo()
         self.logger.info("CreateIsos is done.")
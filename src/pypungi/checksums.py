@@ -0,0 +1,115 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Remember file checksums across runs.
+
+A ChecksumMemo keeps the digests it has computed in a sqlite database,
+keyed by the file's device and inode and the algorithm, along with the
+size and modification time the file had.  A file whose size and mtime
+have not changed since is not read again.
+"""
+
+import hashlib
+import os
+import sqlite3
+
+from pypungi.download import hashName
+
+# Digests are written to the database this many at a time, and on close()
+_BATCH = 1000
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS checksums (
+                 dev INTEGER,
+                 ino INTEGER,
+                 algorithm TEXT,
+                 size INTEGER,
+                 mtime_ns INTEGER,
+                 digest TEXT,
+                 PRIMARY KEY (dev, ino, algorithm))'''
+
+def fileHexdigest(path, algorithm):
+    """Read path and return its hex digest.  algorithm may be a yum
+       checksum type ('sha' for sha1).  Raises ValueError for unknown
+       algorithms and IOError if the file can not be read."""
+
+    sum = hashlib.new(hashName(algorithm))
+    myfile = open(path, 'rb')
+    while True:
+        chunk = myfile.read(1024 * 1024)
+        if not chunk:
+            break
+        sum.update(chunk)
+    myfile.close()
+    return sum.hexdigest()
+
+
+class ChecksumMemo(object):
+    """Digests of files, computed at most once per file version.
+
+       With trust unset remembered digests are never used, every file is
+       read again, and the new digests replace the old ones."""
+
+    def __init__(self, path, trust=True):
+        self.path = path
+        self.trust = trust
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute(_SCHEMA)
+        self.db.commit()
+        self.pending = {} # (dev, ino, algorithm) -> row not written yet
+
+    def _store(self, st, algorithm, mtime_ns, digest):
+        self.pending[(st.st_dev, st.st_ino, algorithm)] = \
+            (st.st_dev, st.st_ino, algorithm, st.st_size, mtime_ns, digest)
+        if len(self.pending) >= _BATCH:
+            self.flush()
+
+    def flush(self):
+        """Write the digests computed since the last flush, in one
+           transaction."""
+
+        if self.pending:
+            self.db.executemany('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)',
+                                self.pending.values())
+            self.db.commit()
+            self.pending.clear()
+
+    def hexdigest(self, path, algorithm):
+        """Return the hex digest of the file at path, like fileHexdigest()."""
+
+        st = os.stat(path)
+        mtime_ns = int(st.st_mtime * 1000000000)
+        if self.trust:
+            row = self.pending.get((st.st_dev, st.st_ino, algorithm))
+            if row is not None and row[3:5] == (st.st_size, mtime_ns):
+                return row[5]
+            row = self.db.execute('SELECT digest FROM checksums WHERE dev = ? AND ino = ? AND '
+                                  'algorithm = ? AND size = ? AND mtime_ns = ?',
+                                  (st.st_dev, st.st_ino, algorithm, st.st_size, mtime_ns)).fetchone()
+            if row is not None:
+                return str(row[0])
+
+        digest = fileHexdigest(path, algorithm)
+        self._store(st, algorithm, mtime_ns, digest)
+        return digest
+
+    def remember(self, path, algorithm, digest):
+        """Record a digest of path that was verified some other way, such
+           as while downloading it."""
+
+        st = os.stat(path)
+        self._store(st, algorithm, int(st.st_mtime * 1000000000), digest)
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,98 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Kickstart group include levels, as in pykickstart.constants
+GROUP_REQUIRED = 0
+GROUP_DEFAULT = 1
+GROUP_ALL = 2
+
+def groupPackages(comps):
+    """Return a dict of group id -> (mandatory, default, optional,
+       conditional) for every group in a yum comps object.  The first three
+       are lists of package names, conditional is a list of (package,
+       required package) name pairs."""
+
+    groups = {}
+    for group in comps.groups:
+        groups[group.groupid] = (group.mandatory_packages.keys(),
+                                 group.default_packages.keys(),
+                                 group.optional_packages.keys(),
+                                 group.conditional_packages.items())
+    return groups
+
+def groupAliases(comps):
+    """Return a dict mapping group ids, names and translated names, both
+       as given and lower-cased, to group ids.  Ids win over names and
+       exact spellings over lower-cased ones, like yum's group lookup."""
+
+    aliases = {}
+    for lower in (True, False):
+        for group in comps.groups:
+            names = [group.name] + group.translated_name.values()
+            for name in names + [group.groupid]:
+                if lower:
+                    name = name.lower()
+                aliases[name] = group.groupid
+    return aliases
+
+def conditionalNames(groups):
+    """Return the set of package names pulled in conditionally by any of
+       the groups from groupPackages()."""
+
+    names = set()
+    for (mandatory, default, optional, conditional) in groups.itervalues():
+        for (condreq, cond) in conditional:
+            names.add(condreq)
+    return names
+
+
+class CompsExpansion(object):
+    """Every comps group's package lists plus the package objects of every
+       conditional package, worked out once for a comps/sack snapshot."""
+
+    def __init__(self, groups, aliases, targets):
+        self.groups = groups
+        self.aliases = aliases
+        self.targets = targets
+
+    def groupId(self, name):
+        """Return the id of the group called name, or None."""
+
+        return self.aliases.get(name, self.aliases.get(name.lower()))
+
+    def hasGroup(self, name):
+        return self.groupId(name) is not None
+
+    def expand(self, groups, include_level=GROUP_DEFAULT):
+        """Expand a list of group names or ids at a kickstart include level.
+
+           Returns a (packages, conditionals) tuple: the list of package
+           names and a list of (required package name, package objects)
+           pairs for the conditional packages of those groups."""
+
+        packages = []
+        conditionals = []
+        for name in groups:
+            (mandatory, default, optional, conditional) = self.groups[self.groupId(name)]
+
+            packages.extend(mandatory)
+            if include_level >= GROUP_DEFAULT:
+                packages.extend(default)
+            if include_level >= GROUP_ALL:
+                packages.extend(optional)
+
+            for (condreq, cond) in conditional:
+                conditionals.append((cond, self.targets.get(condreq, [])))
+
+        return (packages, conditionals)
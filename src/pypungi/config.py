@@ -13,8 +13,8 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
 import os
+import rpmUtils.arch
 import time
-import yum
 
 from ConfigParser import SafeConfigParser
 
@@ -33,7 +33,7 @@ class Config(SafeConfigParser):
         self.set('pungi', 'relnotepkgs', 'fedora-release fedora-release-notes')
         self.set('pungi', 'product_path', 'Packages')
         self.set('pungi', 'cachedir', '/var/cache/pungi')
-        self.set('pungi', 'arch', yum.rpmUtils.arch.getBaseArch(os.uname()[4]))
+        self.set('pungi', 'arch', rpmUtils.arch.getBaseArch(os.uname()[4]))
         self.set('pungi', 'name', 'Fedora')
         self.set('pungi', 'iso_basename', 'Fedora')
         self.set('pungi', 'version', time.strftime('%Y%m%d', time.localtime()))
@@ -42,4 +42,14 @@ class Config(SafeConfigParser):
         self.set('pungi', 'bugurl', 'https://bugzilla.redhat.com')
         self.set('pungi', 'cdsize', '695.0')
         self.set('pungi', 'debuginfo', "True")
+        self.set('pungi', 'source', "True")
+        self.set('pungi', 'selfhosting', "False")
+        self.set('pungi', 'fulltree', "False")
+        self.set('pungi', 'revalidate', "True")
+        self.set('pungi', 'trace', "False")
+        self.set('pungi', 'repoworkers', '4')
+        self.set('pungi', 'downloadworkers', '4')
+        self.set('pungi', 'downloadretries', '3')
+        self.set('pungi', 'poolsize', '0')
+        self.set('pungi', 'fullverify', "False")
 
@@ -0,0 +1,74 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import logging
+
+from pypungi.sourceindex import splitSourceRpm
+
+# Packages whose debuginfo is split out into a -debuginfo-common package
+COMMON_DEBUGINFO = ('kernel', 'glibc')
+
+
+class DebuginfoIndex(object):
+    """Debuginfo packages of a sack, indexed once so that the debuginfo of
+       a whole package list can be matched without searching the sack."""
+
+    def __init__(self, pos):
+        self.logger = logging.getLogger('Pungi')
+        self.by_nevra = {}
+        self.by_nvra = {}
+
+        for po in pos:
+            if '-debuginfo' not in po.name:
+                continue
+            # First one wins, just like searchNevra()[0] did.
+            self.by_nevra.setdefault((po.name, po.epoch, po.version, po.release, po.arch), po)
+            self.by_nvra.setdefault((po.name, po.version, po.release, po.arch), po)
+
+    def resolvePairs(self, pos):
+        """Generate a (package object, debuginfo package object, how)
+           tuple for every debuginfo match of pos.  A package matches a
+           debuginfo package of the same name and EVR, failing that one
+           named after its source rpm; kernel and glibc also get their
+           -debuginfo-common package."""
+
+        for po in pos:
+            debugpo = self.by_nevra.get(('%s-debuginfo' % po.name, po.epoch,
+                                         po.version, po.release, po.arch))
+            if debugpo is not None:
+                yield (po, debugpo, 'name')
+            else:
+                (sname, sver, srel) = splitSourceRpm(po.sourcerpm)
+                debugpo = self.by_nvra.get(('%s-debuginfo' % sname, sver, srel, po.arch))
+                if debugpo is not None:
+                    yield (po, debugpo, 'srpm')
+
+            if po.name in COMMON_DEBUGINFO:
+                debugpo = self.by_nevra.get(('%s-debuginfo-common' % po.name, po.epoch,
+                                             po.version, po.release, po.arch))
+                if debugpo is not None:
+                    yield (po, debugpo, 'common')
+
+    def resolve(self, pos):
+        """Return the list of debuginfo package objects for pos, as
+           matched by resolvePairs()."""
+
+        found = []
+        seen = set()
+        for (po, debugpo, how) in self.resolvePairs(pos):
+            if debugpo not in seen:
+                self.logger.debug('Added %s found by %s' % (debugpo.name, how))
+                seen.add(debugpo)
+                found.append(debugpo)
+        return found
@@ -0,0 +1,361 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Parallel package downloads over kept-alive http connections.
+
+yum fetches packages one at a time, so per-file latency rather than the
+link limits how fast a tree comes down.  A Downloader runs a few transfers
+per host at once, each worker reusing its connection for file after file,
+hands out the largest files first so the tail of the run is short, and
+checksums the data as it arrives.  It knows nothing about yum: give it
+Download objects and a plain http server will do for trying it out.
+
+Given a directory for partial files, a transfer that breaks off is kept
+there, named by its checksum, with a record of how much of it is good.
+The next attempt, in this run or a later one, asks the server for just the
+rest with a Range request.
+"""
+
+import collections
+import errno
+import hashlib
+import httplib
+import os
+import socket
+import tempfile
+import threading
+import time
+import urlparse
+
+import pypungi.util
+from pypungi.exceptions import DownloadError
+
+_CHUNK = 65536
+_REDIRECTS = 5
+_REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+# How often the record of a partial download is brought up to date
+_RECORD_EVERY = 8 * 1024 * 1024
+
+# yum's checksum type names that hashlib spells differently
+_HASHES = {'sha': 'sha1'}
+
+def hashName(checksum_type):
+    """Return the hashlib name for a yum checksum type."""
+
+    return _HASHES.get(checksum_type, checksum_type)
+
+
+class Download(object):
+    """A file to fetch: mirror urls to try in order, the local path, the
+       expected size (or None) and the expected (type, checksum)."""
+
+    def __init__(self, urls, path, size, checksum_type, checksum):
+        self.urls = list(urls)
+        self.path = path
+        self.size = size
+        self.checksum_type = checksum_type
+        self.checksum = checksum
+
+    def __repr__(self):
+        return '<Download %s>' % self.path
+
+
+class Downloader(object):
+    """Fetch Downloads over http and https, perhost at a time per host.
+
+       A download that fails from every mirror is tried again retries
+       times, waiting backoff seconds before the first retry and twice as
+       long before each one after.  With partialdir set, broken off
+       transfers are resumed rather than started over."""
+
+    def __init__(self, logger, perhost=4, timeout=300, partialdir=None,
+                 retries=3, backoff=2.0):
+        self.logger = logger
+        self.perhost = max(1, perhost)
+        self.timeout = timeout
+        self.partialdir = partialdir
+        self.retries = max(0, retries)
+        self.backoff = backoff
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _request(self, conns, scheme, netloc, path, headers):
+        """Send a GET on the worker's connection to netloc, opening a new
+           one if there is none or the server closed the kept-alive one."""
+
+        conn = conns.get((scheme, netloc))
+        if conn is not None:
+            try:
+                conn.request('GET', path, headers=headers)
+                return conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+
+        conn = conns[(scheme, netloc)] = self._connect(scheme, netloc)
+        conn.request('GET', path, headers=headers)
+        return conn.getresponse()
+
+    def _open(self, conns, url, offset=0):
+        """Return the response for a GET of url, following redirects.  With
+           an offset, ask for the file from there on; the response status
+           says whether the server did (206), sent all of it (200) or found
+           the file shorter than offset (416)."""
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        for redirect in range(_REDIRECTS):
+            (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+            if query:
+                path = '%s?%s' % (path, query)
+            response = self._request(conns, scheme, netloc, path or '/', headers)
+
+            if response.status in _REDIRECT_STATUS and response.getheader('location'):
+                response.read()
+                url = urlparse.urljoin(url, response.getheader('location'))
+                continue
+            if response.status not in (200, 206, 416):
+                response.read()
+                raise DownloadError('HTTP %d %s' % (response.status, response.reason))
+            return response
+
+        raise DownloadError('too many redirects')
+
+    def _partialPaths(self, download):
+        """Return the paths of the partial file, its record and its lock."""
+
+        base = os.path.join(self.partialdir, '%s-%s' % (download.checksum_type, download.checksum))
+        return ('%s.part' % base, '%s.record' % base, '%s.lock' % base)
+
+    def _lockPartial(self, lockpath):
+        """Lock a partial download against other workers and processes.
+           The lock file is removed once the download is done, so make sure
+           the file locked is still the one at lockpath."""
+
+        while True:
+            lock = pypungi.util._lockFile(lockpath)
+            try:
+                if os.fstat(lock.fileno()).st_ino == os.stat(lockpath).st_ino:
+                    return lock
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    lock.close()
+                    raise
+            lock.close()
+
+    def _resumeOffset(self, download, partpath, recordpath):
+        """Return how many bytes of a partial download can be kept, going
+           by its record, and drop the rest."""
+
+        record = pypungi.util._readPickle(recordpath)
+        if record is None or not os.path.exists(partpath) or \
+           (record['checksum_type'], record['checksum'], record['size']) != \
+           (download.checksum_type, download.checksum, download.size):
+            return 0
+        offset = min(record['bytes'], os.path.getsize(partpath))
+        if download.size is not None and offset > download.size:
+            return 0
+        return offset
+
+    def _dropPartial(self, partpath, recordpath):
+        for path in (partpath, recordpath):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _writeRecord(self, download, url, recordpath, size):
+        pypungi.util._writePickle(recordpath, {'checksum_type': download.checksum_type,
+                                               'checksum': download.checksum,
+                                               'size': download.size,
+                                               'url': url,
+                                               'bytes': size})
+
+    def _fetchFrom(self, conns, download, url):
+        """Stream url into download.path, checking size and checksum on
+           the way.  The file only appears once it is complete and good."""
+
+        if self.partialdir is None:
+            (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(download.path), prefix='.pungi')
+            out = os.fdopen(fd, 'wb')
+            try:
+                self._stream(download, url, self._open(conns, url), out, 0, None)
+            except:
+                out.close()
+                os.remove(tmppath)
+                raise
+            os.rename(tmppath, download.path)
+            return
+
+        (partpath, recordpath, lockpath) = self._partialPaths(download)
+        lock = self._lockPartial(lockpath)
+        try:
+            offset = self._resumeOffset(download, partpath, recordpath)
+            if offset:
+                self.logger.info('Resuming %s at byte %d' % (os.path.basename(download.path), offset))
+
+            response = None
+            if download.size is None or offset < download.size:
+                response = self._open(conns, url, offset)
+                if response.status == 200:
+                    offset = 0 # the server does not do ranges
+                elif response.status == 416 or \
+                     not (response.getheader('content-range') or '').startswith('bytes %d-' % offset):
+                    # Not the file the partial one is part of
+                    response.read()
+                    self._dropPartial(partpath, recordpath)
+                    raise DownloadError('can not resume at byte %d' % offset)
+
+            if not os.path.exists(partpath):
+                open(partpath, 'wb').close()
+            out = open(partpath, 'r+b')
+            try:
+                out.truncate(offset)
+                self._stream(download, url, response, out, offset, recordpath)
+            except DownloadError:
+                # Complete but bad, start over next time
+                out.close()
+                self._dropPartial(partpath, recordpath)
+                raise
+            except:
+                out.close()
+                raise
+
+            os.rename(partpath, download.path)
+            os.remove(recordpath)
+        finally:
+            # Nothing left to resume, so the lock can go
+            if not os.path.exists(partpath):
+                os.remove(lockpath)
+            lock.close()
+
+    def _stream(self, download, url, response, out, offset, recordpath):
+        """Write the response body to out after the first offset bytes
+           already there, then check size and checksum.  Progress goes to
+           recordpath every so often, and when the transfer breaks off.
+           Closes out."""
+
+        digest = hashlib.new(hashName(download.checksum_type))
+        out.seek(0)
+        while out.tell() < offset:
+            chunk = out.read(min(_CHUNK, offset - out.tell()))
+            if not chunk:
+                break
+            digest.update(chunk)
+        out.seek(offset)
+
+        size = offset
+        recorded = size
+        try:
+            while response is not None:
+                chunk = response.read(_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+                if recordpath is not None and size - recorded >= _RECORD_EVERY:
+                    out.flush()
+                    self._writeRecord(download, url, recordpath, size)
+                    recorded = size
+        finally:
+            out.close()
+            if recordpath is not None:
+                self._writeRecord(download, url, recordpath, size)
+
+        if download.size is not None and size != download.size:
+            if size < download.size:
+                # Broke off early, keep what there is
+                raise IOError('got %d bytes, expected %d' % (size, download.size))
+            raise DownloadError('got %d bytes, expected %d' % (size, download.size))
+        if digest.hexdigest() != download.checksum:
+            raise DownloadError('%s checksum does not match' % download.checksum_type)
+
+    def fetch(self, conns, download):
+        """Fetch a download from the first mirror that works, going through
+           the mirrors again after a pause if none does.  conns is the
+           calling worker's dict of open connections.  Returns the list of
+           errors, empty on success."""
+
+        errors = []
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                self.logger.warning('Retrying %s in %g seconds' % (
+                    os.path.basename(download.path), delay))
+                time.sleep(delay)
+            for url in download.urls:
+                try:
+                    self._fetchFrom(conns, download, url)
+                    return []
+                except (DownloadError, httplib.HTTPException, socket.error, IOError, OSError), e:
+                    errors.append('%s: %s' % (url, e))
+                    # A transfer that broke off leaves its connection unusable
+                    for conn in conns.values():
+                        conn.close()
+                    conns.clear()
+        return errors
+
+    def run(self, downloads):
+        """Fetch every download, largest first, with up to perhost
+           transfers per host (of the first mirror) at once.
+
+           Returns a dict of Download -> list of errors for the ones that
+           could not be fetched from any mirror."""
+
+        downloads = list(downloads)
+        downloads.sort(key=lambda download: download.size, reverse=True)
+
+        queues = {}
+        for download in downloads:
+            host = urlparse.urlsplit(download.urls[0])[1]
+            queues.setdefault(host, collections.deque()).append(download)
+
+        failed = {}
+        done = [0]
+        total = len(downloads)
+
+        def worker(queue):
+            conns = {}
+            try:
+                while True:
+                    try:
+                        download = queue.popleft()
+                    except IndexError:
+                        return
+                    errors = self.fetch(conns, download)
+                    if errors:
+                        failed[download] = errors
+                        self.logger.error('Failed to download %s' % os.path.basename(download.path))
+                        continue
+                    done[0] += 1
+                    self.logger.info('Downloaded %d/%d: %s' % (done[0], total,
+                                                              os.path.basename(download.path)))
+            finally:
+                for conn in conns.values():
+                    conn.close()
+
+        threads = []
+        for queue in queues.values():
+            for count in range(min(self.perhost, len(queue))):
+                thread = threading.Thread(target=worker, args=(queue,))
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        return failed
@@ -1,7 +1,10 @@
-import yum
-
-class PungiError(yum.Errors.MiscError):
+# Deliberately not derived from yum's errors, so that stages which never
+# touch yum do not have to import it.
+class PungiError(Exception):
     pass
 
 class MissingPackageError(PungiError):
-    pass
\ No newline at end of file
+    pass
+
+class DownloadError(PungiError):
+    pass
@@ -0,0 +1,127 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""File requirements the primary metadata can not answer.
+
+Primary metadata only lists a subset of files (/etc, the bin directories
+and so on); for any other path yum loads the complete filelists of every
+repo.  Here filelists are only searched for the paths actually required:
+through the dirname index of a filelists database if the repo has one,
+otherwise by streaming the filelists xml without keeping it.  The answers,
+including "nothing provides this", go into a small FileIndex so that later
+runs against the same metadata do not search again.
+"""
+
+import os
+import xml.etree.cElementTree
+
+_FILELISTS_NS = '{http://linux.duke.edu/metadata/filelists}'
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def scanFilelistsDb(filelistsdb, primarydb, paths):
+    """Search a yum filelists sqlite database for paths.  The primary
+       database of the same repo maps the package ids found to package
+       tuples.
+
+       Returns a dict of path -> list of package tuples."""
+
+    found = dict([(path, []) for path in paths])
+    bydir = {}
+    for path in paths:
+        (dirname, basename) = os.path.split(path)
+        bydir.setdefault(dirname, {})[basename] = path
+
+    filecur = filelistsdb.cursor()
+    pkgcur = primarydb.cursor()
+    for (dirname, basenames) in bydir.iteritems():
+        filecur.execute('SELECT packages.pkgId, filelist.filenames '
+                        'FROM filelist JOIN packages USING (pkgKey) '
+                        'WHERE filelist.dirname = ?', (dirname,))
+        for (pkgid, filenames) in filecur.fetchall():
+            for basename in filenames.split('/'):
+                if not basenames.has_key(basename):
+                    continue
+                pkgcur.execute('SELECT name, arch, epoch, version, release '
+                               'FROM packages WHERE pkgId = ?', (pkgid,))
+                for row in pkgcur:
+                    found[basenames[basename]].append(tuple(row))
+    return found
+
+def scanFilelistsXml(fileobj, paths):
+    """Search a filelists.xml stream for paths, one package at a time.
+
+       Returns a dict of path -> list of package tuples."""
+
+    found = dict([(path, []) for path in paths])
+    root = None
+    for (event, elem) in xml.etree.cElementTree.iterparse(fileobj, ('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end' or elem.tag != _FILELISTS_NS + 'package':
+            continue
+
+        pkgtup = None
+        for fileelem in elem.findall(_FILELISTS_NS + 'file'):
+            if fileelem.text in found:
+                if pkgtup is None:
+                    version = elem.find(_FILELISTS_NS + 'version')
+                    pkgtup = (elem.get('name'), elem.get('arch'), version.get('epoch'),
+                              version.get('ver'), version.get('rel'))
+                found[fileelem.text].append(pkgtup)
+        root.clear()
+    return found
+
+
+class FileIndex(object):
+    """A persistent path -> package tuples map.
+
+       Kept as an append-only file of tab separated lines: the path, then
+       one field per provider holding its package tuple joined by spaces.
+       A path with no providers was searched for and not found."""
+
+    def __init__(self, path):
+        self.path = path
+        self.paths = {}
+        if os.path.exists(path):
+            for line in open(path, 'r'):
+                fields = line.rstrip('\n').split('\t')
+                self.paths[fields[0]] = [tuple(field.split(' ')) for field in fields[1:]]
+
+    def lookup(self, path):
+        """Return the package tuples providing path, or None if it has not
+           been searched for."""
+
+        return self.paths.get(path)
+
+    def add(self, found):
+        """Record the result of a search, a dict of path -> package tuples."""
+
+        lines = []
+        for (path, pkgtups) in found.iteritems():
+            self.paths[path] = pkgtups
+            if '\t' in path or '\n' in path:
+                continue # can not be stored, search again next time
+            fields = [path] + [' '.join([_encode(x) for x in pkgtup]) for pkgtup in pkgtups]
+            lines.append('\t'.join([_encode(x) for x in fields]))
+
+        if lines:
+            # One write to a file opened for appending, so processes sharing
+            # the cachedir do not interleave lines.
+            out = open(self.path, 'a')
+            out.write(''.join(['%s\n' % line for line in lines]))
+            out.close()
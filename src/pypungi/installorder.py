@@ -0,0 +1,61 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Order packages for split media from the gather dependency graph.
+
+This gives what anaconda's pkgorder is used for: the packages of the first
+groups (core, base, ...) and everything they need come first, so an install
+of those groups only needs the first discs.  The graph comes from gather,
+so there is no need to read the tree or resolve dependencies again.
+"""
+
+def installOrder(seeds, depgraph, keys):
+    """Return keys in install order.
+
+       seeds is a list of lists of package keys, one list per group (or
+       the kickstart package list), in the order the groups should go on
+       the media.  depgraph maps a package key to the keys of the packages
+       gather added for its requirements, and keys is every package key in
+       gather order.  Each package comes after its dependencies; once the
+       seeds are placed the rest follow in gather order.  Keys not in keys
+       are left out."""
+
+    wanted = set(keys)
+    placed = set()
+    order = []
+
+    def place(key):
+        # Iterative depth first walk, emitting a package once all of its
+        # dependencies are out; cycles are broken where they are found.
+        if key in placed or key not in wanted:
+            return
+        placed.add(key)
+        stack = [(key, iter(depgraph.get(key, ())))]
+        while stack:
+            (current, deps) = stack[-1]
+            for dep in deps:
+                if dep not in placed and dep in wanted:
+                    placed.add(dep)
+                    stack.append((dep, iter(depgraph.get(dep, ()))))
+                    break
+            else:
+                stack.pop()
+                order.append(current)
+
+    for group in seeds:
+        for key in group:
+            place(key)
+    for key in keys:
+        place(key)
+    return order
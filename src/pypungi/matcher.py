@@ -0,0 +1,182 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Match kickstart package names and globs against a sack.
+
+This understands the same spellings as yum.packages.parsePackages (name,
+name.arch, name-ver, name-ver-rel, name-ver-rel.arch, epoch:name-ver-rel.arch
+and name-epoch:ver-rel.arch, matched case sensitively), but looks plain names
+up in a name index and only tries each glob against keys that start with the
+glob's literal prefix, so the cost does not grow with packages x patterns.
+"""
+
+import fnmatch
+import re
+
+_GLOB = re.compile('[*?[]')
+_SPLIT = re.compile('[-.:]')
+
+def _unique(seq):
+    """Return the items of seq without repeats, keeping their order."""
+
+    seen = set()
+    result = []
+    for item in seq:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+def buildNameIndex(pos):
+    """Return a dict of package name -> list of package objects."""
+
+    index = {}
+    for po in pos:
+        index.setdefault(po.name, []).append(po)
+    return index
+
+def packageKeys(po):
+    """Return every spelling a package can be referred to by, name first."""
+
+    (n, a, e, v, r) = po.pkgtup
+    return (n,
+            '%s.%s' % (n, a),
+            '%s-%s-%s.%s' % (n, v, r, a),
+            '%s-%s' % (n, v),
+            '%s-%s-%s' % (n, v, r),
+            '%s:%s-%s-%s.%s' % (e, n, v, r, a),
+            '%s-%s:%s-%s.%s' % (n, e, v, r, a))
+
+
+class PackageMatcher(object):
+    """A set of package names and globs compiled for matching.
+
+       Exact terms are looked up directly; globs are bucketed by the literal
+       text before their first wildcard, which works as a flat prefix trie
+       when walking the keys of the sack."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.exact = []
+        self.globs = {} # literal prefix -> list of (pattern, compiled regex)
+
+        for pattern in self.patterns:
+            wildcard = _GLOB.search(pattern)
+            if wildcard is None:
+                self.exact.append(pattern)
+            else:
+                prefix = pattern[:wildcard.start()]
+                self.globs.setdefault(prefix, []).append(
+                    (pattern, re.compile(fnmatch.translate(pattern))))
+
+        self.prefixlens = list(set([len(prefix) for prefix in self.globs.keys()]))
+        self.prefixlens.sort()
+
+    def candidates(self):
+        """Work out which package names the patterns could match, for
+           looking packages up by name before building a name index.
+
+           Returns a (names, prefixes, everything) tuple: the set of names
+           the exact terms may refer to, the set of name prefixes the globs
+           may match, and whether some glob may match any package."""
+
+        names = set()
+        prefixes = set()
+        everything = False
+
+        for term in self.exact:
+            names.add(term)
+            names.update([term[:m.start()] for m in _SPLIT.finditer(term)])
+            if ':' in term:
+                names.add(term.split(':', 1)[1].rsplit('-', 2)[0])
+
+        for prefix in self.globs.keys():
+            # Spellings start with the name or, for epoch:name-ver-rel.arch,
+            # the epoch; a glob matches a spelling whose name starts with the
+            # prefix or whose name ends at a separator inside the prefix.
+            if ':' in prefix:
+                (before, prefix) = prefix.split(':', 1)
+                names.update([before[:m.start()] for m in _SPLIT.finditer(before)])
+                if not before.isdigit():
+                    continue # name-epoch:ver-rel.arch
+            elif prefix.isdigit():
+                prefix = ''
+            if not prefix:
+                everything = True
+                break
+            prefixes.add(prefix)
+            names.update([prefix[:m.start()] for m in _SPLIT.finditer(prefix)])
+
+        return (names, prefixes, everything)
+
+    def _globMatches(self, key):
+        """Generate the glob patterns matching key."""
+
+        for length in self.prefixlens:
+            if length > len(key):
+                break
+            for (pattern, regex) in self.globs.get(key[:length], ()):
+                if regex.match(key):
+                    yield pattern
+
+    def _exactMatches(self, term, nameindex):
+        """Return the package objects term names exactly."""
+
+        if nameindex.has_key(term):
+            return nameindex[term]
+
+        # Not a bare name; the name is a prefix of the term ending at one of
+        # the separators (or follows the epoch), so only look at those.
+        found = []
+        candidates = [term[:m.start()] for m in _SPLIT.finditer(term)]
+        if ':' in term:
+            candidates.append(term.split(':', 1)[1].rsplit('-', 2)[0])
+        for name in _unique(candidates):
+            for po in nameindex.get(name, ()):
+                if term in packageKeys(po):
+                    found.append(po)
+        return found
+
+    def match(self, nameindex):
+        """Match the patterns against a name index from buildNameIndex().
+
+           Returns a (matched, unmatched) tuple: the list of matching package
+           objects and the list of patterns that matched nothing."""
+
+        matched = []
+        seen = set()
+        hit = set()
+
+        def add(po, pattern):
+            hit.add(pattern)
+            if po not in seen:
+                seen.add(po)
+                matched.append(po)
+
+        for term in self.exact:
+            for po in self._exactMatches(term, nameindex):
+                add(po, term)
+
+        if self.globs:
+            for (name, pos) in nameindex.iteritems():
+                for pattern in self._globMatches(name):
+                    for po in pos:
+                        add(po, pattern)
+                for po in pos:
+                    for key in packageKeys(po)[1:]:
+                        for pattern in self._globMatches(key):
+                            add(po, pattern)
+
+        unmatched = [pattern for pattern in self.patterns if pattern not in hit]
+        return (matched, unmatched)
@@ -0,0 +1,90 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Run the gather stage for several arches of a compose at once.
+
+Each arch is gathered in a process of its own, since the yum sack, the
+dependency closure and the downloads depend on the arch.  What does not is
+shared through the cachedir: repos whose url does not mention $basearch are
+fetched by whichever arch gets to them first while the others wait for it
+and then find the metadata current, and the provides index, which covers
+every arch of the repo metadata, is built once and mapped by every arch.
+"""
+
+import multiprocessing
+import sys
+import traceback
+
+import pypungi
+import pypungi.pkgtable
+
+def _gatherArch(args):
+    """Run the gather stage for one arch.  Runs in a pool process, and
+       returns (arch, polist, srpmpolist, debuginfolist, error) with the
+       lists as PackageEntry lists, or None and a description of what went
+       wrong in error.  Nothing may escape: a SystemExit from the stage
+       would take the pool process down and leave the parent waiting."""
+
+    (config, kickstart, arch) = args
+
+    try:
+        import pykickstart.parser
+        import pykickstart.version
+        ksparser = pykickstart.parser.KickstartParser(pykickstart.version.makeVersion())
+        ksparser.readKickstart(kickstart)
+
+        config.set('pungi', 'arch', arch)
+        mypungi = pypungi.Pungi(config, ksparser)
+        mypungi._inityum()
+        mypungi.doGather()
+    except SystemExit, e:
+        return (arch, None, None, None, 'exited with status %s' % e.code)
+    except Exception:
+        return (arch, None, None, None, traceback.format_exc())
+
+    return (arch, mypungi.polist.entries, mypungi.srpmpolist.entries,
+            mypungi.debuginfolist.entries, None)
+
+def gatherArches(config, kickstart, arches, workers=None):
+    """Gather every arch in arches for the kickstart file, running up to
+       workers arches at a time (defaults to one per cpu).  Exits if any
+       arch fails, once all of them have finished.
+
+       Returns a dict of arch -> (polist, srpmpolist, debuginfolist), each
+       a PackageTable without package objects."""
+
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(arches)))
+
+    # A fresh process per arch, so every arch gets its own log file.
+    pool = multiprocessing.Pool(workers, maxtasksperchild=1)
+    try:
+        results = pool.map(_gatherArch, [(config, kickstart, arch) for arch in arches], 1)
+    finally:
+        pool.close()
+        pool.join()
+
+    gathered = {}
+    failed = False
+    for (arch, polist, srpmpolist, debuginfolist, error) in results:
+        if error is not None:
+            print >> sys.stderr, "Gathering %s failed: %s" % (arch, error.rstrip())
+            failed = True
+            continue
+        gathered[arch] = tuple([pypungi.pkgtable.PackageTable(None, entries)
+                                for entries in (polist, srpmpolist, debuginfolist)])
+    if failed:
+        sys.exit(1)
+    return gathered
@@ -0,0 +1,130 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+def _intern(value):
+    if type(value) is str:
+        return intern(value)
+    return value
+
+def packageKey(po):
+    """Return the key identifying a package object (or PackageEntry) in a
+       PackageTable."""
+
+    return (po.repoid, po.pkgtup)
+
+
+class PackageEntry(object):
+    """The parts of a package object the compose needs after gather.
+
+       Attribute names follow yum's package objects, so entries can be
+       passed to code that only reads these fields."""
+
+    __slots__ = ('pkgid', 'name', 'arch', 'epoch', 'version', 'release',
+                 'repoid', 'sourcerpm', 'relativepath', 'size',
+                 'checksum_type', 'checksum')
+
+    def __init__(self, pkgid, po):
+        self.pkgid = pkgid
+        self.name = _intern(po.name)
+        self.arch = _intern(po.arch)
+        self.epoch = _intern(po.epoch)
+        self.version = _intern(po.version)
+        self.release = _intern(po.release)
+        self.repoid = _intern(po.repoid)
+        self.sourcerpm = po.sourcerpm
+        self.relativepath = po.relativepath
+        self.size = int(po.size)
+        (checksum_type, self.checksum) = po.returnIdSum()
+        self.checksum_type = _intern(checksum_type)
+
+    def _pkgtup(self):
+        return (self.name, self.arch, self.epoch, self.version, self.release)
+    pkgtup = property(_pkgtup)
+
+    def returnIdSum(self):
+        return (self.checksum_type, self.checksum)
+
+    def __repr__(self):
+        return '<PackageEntry %d: %s-%s:%s-%s.%s>' % (
+            self.pkgid, self.name, self.epoch, self.version, self.release, self.arch)
+
+
+class PackageTable(object):
+    """An insertion ordered set of packages.
+
+       Each package gets an integer id (its position in the table) and is
+       stored as a compact PackageEntry.  Membership checks take either
+       package objects or entries and are constant time.  Package objects
+       are kept around until detach() is called; after that they are
+       looked up again on demand through resolver(entry)."""
+
+    __slots__ = ('entries', '_ids', '_pos', '_resolver')
+
+    def __init__(self, resolver, pos=()):
+        self.entries = []
+        self._ids = {}
+        self._pos = {}
+        self._resolver = resolver
+        self.extend(pos)
+
+    def append(self, po):
+        """Add a package object (or an entry of another table) unless it is
+           already in the table.  Returns its entry."""
+
+        key = packageKey(po)
+        pkgid = self._ids.get(key)
+        if pkgid is not None:
+            return self.entries[pkgid]
+
+        pkgid = len(self.entries)
+        entry = PackageEntry(pkgid, po)
+        self._ids[key] = pkgid
+        self.entries.append(entry)
+        if not isinstance(po, PackageEntry):
+            self._pos[pkgid] = po
+        return entry
+
+    def extend(self, pos):
+        for po in pos:
+            self.append(po)
+
+    def __contains__(self, po):
+        return packageKey(po) in self._ids
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def packageObject(self, entry):
+        """Return the package object for an entry of this table."""
+
+        po = self._pos.get(entry.pkgid)
+        if po is None:
+            po = self._resolver(entry)
+        return po
+
+    def packageObjects(self):
+        """Return the package objects of the whole table, in order."""
+
+        return [self.packageObject(entry) for entry in self.entries]
+
+    def detach(self):
+        """Drop the references to package objects held for gather."""
+
+        self._pos.clear()
@@ -0,0 +1,198 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""A content addressed package store in the cachedir.
+
+Packages are kept once per checksum, as <root>/<type>/<xx>/<checksum>,
+however many repos or composes they came through, and trees are hardlinked
+from there.  When each entry was last used is recorded in a small sqlite
+database next to them, so the store can be trimmed to a size cap by
+dropping the least recently used entries.
+"""
+
+import errno
+import os
+import pypungi.util
+import sqlite3
+import time
+
+# Entries used this recently are never evicted, so a compose running at the
+# same time as a gc does not lose packages it is about to link.
+GRACE = 3600
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS pool (
+                 checksum TEXT PRIMARY KEY,
+                 size INTEGER,
+                 lastuse REAL)'''
+
+
+class PackagePool(object):
+    """The package store under root."""
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.db = sqlite3.connect(os.path.join(root, 'pool.db'), timeout=60)
+        self.db.execute(_SCHEMA)
+        self.db.commit()
+        # Last use updates (key -> (size, time), or None to forget the key)
+        # waiting for commit().  Kept here rather than in an open
+        # transaction, so other composes are not locked out meanwhile.
+        self.pending = {}
+
+    def _key(self, checksum_type, checksum):
+        return '%s:%s' % (checksum_type, checksum)
+
+    def _path(self, key):
+        (checksum_type, checksum) = key.split(':', 1)
+        return os.path.join(self.root, checksum_type, checksum[:2], checksum)
+
+    def _touch(self, key, size):
+        self.pending[key] = (size, time.time())
+
+    def commit(self):
+        """Write the recorded uses and removals to the database, in one
+           transaction."""
+
+        if not self.pending:
+            return
+        forgotten = []
+        used = []
+        for (key, value) in self.pending.iteritems():
+            if value is None:
+                forgotten.append((key,))
+            else:
+                used.append((key,) + value)
+        self.db.executemany('DELETE FROM pool WHERE checksum = ?', forgotten)
+        self.db.executemany('INSERT OR REPLACE INTO pool (checksum, size, lastuse) VALUES (?, ?, ?)',
+                            used)
+        self.db.commit()
+        self.pending.clear()
+
+    def contains(self, checksum_type, checksum):
+        """Return whether a package is in the store, without counting it as
+           a use."""
+
+        return os.path.exists(self._path(self._key(checksum_type, checksum)))
+
+    def lookup(self, checksum_type, checksum):
+        """Return the path of a package in the store, or None if it is not
+           there.  Counts as a use, written out by commit()."""
+
+        key = self._key(checksum_type, checksum)
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.pending[key] = None
+            return None
+        self._touch(key, os.path.getsize(path))
+        return path
+
+    def add(self, path, checksum_type, checksum, remove=False):
+        """Put the (already verified) file at path into the store, by
+           hardlinking it or copying across file systems.  With remove,
+           path itself is unlinked afterwards, so the store holds the only
+           copy.  Returns the path in the store."""
+
+        key = self._key(checksum_type, checksum)
+        target = self._path(key)
+        if not os.path.exists(target):
+            try:
+                os.makedirs(os.path.dirname(target))
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            # Built under a name of our own and renamed into place, so
+            # target only ever appears complete
+            tmppath = pypungi.util._tempName(target)
+            try:
+                try:
+                    os.link(path, tmppath)
+                except OSError, e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    pypungi.util._copyFile(path, tmppath)
+                os.rename(tmppath, target)
+            except:
+                if os.path.exists(tmppath):
+                    os.remove(tmppath)
+                raise
+        if remove:
+            os.remove(path)
+        self._touch(key, os.path.getsize(target))
+        return target
+
+    def remove(self, checksum_type, checksum):
+        """Drop a package from the store."""
+
+        key = self._key(checksum_type, checksum)
+        try:
+            os.remove(self._path(key))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.pending[key] = None
+
+    def stats(self):
+        """Return a dict describing the store: number of entries, their
+           total bytes, the bytes only the store holds (not linked into any
+           tree), and the oldest and newest last use times."""
+
+        self.commit()
+        stats = {'entries': 0, 'bytes': 0, 'unshared': 0, 'oldest': None, 'newest': None}
+        for (key, size, lastuse) in self.db.execute('SELECT checksum, size, lastuse FROM pool'):
+            try:
+                st = os.stat(self._path(key))
+            except OSError:
+                continue
+            stats['entries'] += 1
+            stats['bytes'] += st.st_size
+            if st.st_nlink == 1:
+                stats['unshared'] += st.st_size
+            if stats['oldest'] is None or lastuse < stats['oldest']:
+                stats['oldest'] = lastuse
+            if stats['newest'] is None or lastuse > stats['newest']:
+                stats['newest'] = lastuse
+        return stats
+
+    def gc(self, maxbytes):
+        """Drop the least recently used entries until the store is no
+           bigger than maxbytes, sparing anything used in the last GRACE
+           seconds.  Returns (entries removed, bytes removed)."""
+
+        self.commit()
+        rows = self.db.execute('SELECT checksum, size, lastuse FROM pool ORDER BY lastuse').fetchall()
+        total = sum([size for (key, size, lastuse) in rows])
+        cutoff = time.time() - GRACE
+
+        removed = 0
+        freed = 0
+        for (key, size, lastuse) in rows:
+            if total <= maxbytes or lastuse > cutoff:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            self.db.execute('DELETE FROM pool WHERE checksum = ?', (key,))
+            total -= size
+            freed += size
+            removed += 1
+        self.db.commit()
+        return (removed, freed)
+
+    def close(self):
+        self.commit()
+        self.db.close()
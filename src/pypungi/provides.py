@@ -0,0 +1,151 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""On-disk provides -> package index.
+
+The index is a single file that is mmap()ed read-only, so several pungi
+processes (one per arch, say) composing from the same repos share one copy
+of it through the page cache.  Layout:
+
+    MAGIC
+    count                       (unsigned 64 bit, little endian)
+    offsets[count]              (unsigned 64 bit, little endian)
+    records                     key '\\0' provider ('\\x1e' provider)* '\\n'
+
+Records are sorted by key so lookups are a binary search over the offsets
+table.  A provider is the tab separated package tuple (name, arch, epoch,
+version, release) followed by the flags, epoch, version and release of the
+provide itself.  Package tuples are arch neutral; callers map them back to
+package objects through their own (arch filtered) sack.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = 'PUNGIPRV\x01'
+_HEADER = len(MAGIC) + 8
+_SEP = '\x1e'
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def _decode(value):
+    if value == '':
+        return None
+    return value
+
+def buildIndex(path, records):
+    """Write an index to path from an iterable of
+       (provide name, pkgtup, (flags, epoch, version, release)) tuples.
+
+       The file is written next to its final location and renamed into
+       place, so concurrent readers never see a partial index."""
+
+    providers = {}
+    for (name, pkgtup, prov) in records:
+        entry = '\t'.join([_encode(x) for x in tuple(pkgtup) + tuple(prov)])
+        providers.setdefault(_encode(name), []).append(entry)
+
+    keys = providers.keys()
+    keys.sort()
+
+    dirname = os.path.dirname(path)
+    (fd, tmppath) = tempfile.mkstemp(dir=dirname, prefix='.provides')
+    out = os.fdopen(fd, 'wb')
+    try:
+        offsets = []
+        data = []
+        pos = _HEADER + 8 * len(keys)
+        for key in keys:
+            record = '%s\0%s\n' % (key, _SEP.join(providers[key]))
+            offsets.append(pos)
+            data.append(record)
+            pos += len(record)
+
+        out.write(MAGIC)
+        out.write(struct.pack('<Q', len(keys)))
+        out.write(struct.pack('<%dQ' % len(offsets), *offsets))
+        out.write(''.join(data))
+        out.close()
+    except:
+        out.close()
+        os.remove(tmppath)
+        raise
+
+    os.chmod(tmppath, 0644)
+    os.rename(tmppath, path)
+
+
+class ProvidesIndex(object):
+    """Read-only, memory-mapped view of an index written by buildIndex()."""
+
+    def __init__(self, path):
+        self.path = path
+        indexfile = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(indexfile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            indexfile.close()
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError('%s is not a provides index' % path)
+        (self._count,) = struct.unpack_from('<Q', self._map, len(MAGIC))
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, i):
+        return struct.unpack_from('<Q', self._map, _HEADER + 8 * i)[0]
+
+    def _key(self, offset):
+        return self._map[offset:self._map.find('\0', offset)]
+
+    def lookup(self, name):
+        """Return a list of (pkgtup, (flags, epoch, version, release)) for
+           everything providing name."""
+
+        name = _encode(name)
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(self._offset(mid)) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == self._count:
+            return []
+        offset = self._offset(lo)
+        if self._key(offset) != name:
+            return []
+
+        start = offset + len(name) + 1
+        record = self._map[start:self._map.find('\n', start)]
+
+        result = []
+        for entry in record.split(_SEP):
+            fields = [_decode(x) for x in entry.split('\t')]
+            result.append((tuple(fields[:5]), tuple(fields[5:])))
+        return result
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,49 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+def splitSourceRpm(sourcerpm):
+    """Split a sourcerpm header value (name-version-release.src.rpm) into
+       a (name, version, release) tuple."""
+
+    return tuple(sourcerpm.split('.src.rpm')[0].rsplit('-', 2))
+
+
+class SourceIndex(object):
+    """Source <-> binary package mappings built in one pass over a sack.
+
+       Source packages are keyed by (name, version, release); binaries are
+       grouped under the same key taken from their sourcerpm header."""
+
+    def __init__(self, pos):
+        self.srpms = {}
+        self.binaries = {}
+
+        for po in pos:
+            if po.arch == 'src':
+                # First one wins, just like searchNevra()[0] did.
+                self.srpms.setdefault((po.name, po.version, po.release), po)
+            else:
+                self.binaries.setdefault(splitSourceRpm(po.sourcerpm), []).append(po)
+
+    def sourceFor(self, po):
+        """Return the source package object for a binary package object,
+           or None if the sack does not have it."""
+
+        return self.srpms.get(splitSourceRpm(po.sourcerpm))
+
+    def binariesFor(self, srpmpo):
+        """Return the list of binary package objects built from a source
+           package object."""
+
+        return self.binaries.get((srpmpo.name, srpmpo.version, srpmpo.release), [])
@@ -51,6 +51,9 @@ class Timber:
 self.package_order_file : the location of the file which has
 the package ordering
 
+self.package_order : the package ordering as a list of n-v-r.a.rpm
+names, used instead of package_order_file if set
+
 self.arch : the arch the tree is intended for
 
 self.real_arch : the arch found in the unified tree's
@@ -86,6 +89,7 @@ self.reserve_size : Additional size needed to be reserved on the first disc.
         self.comps_size = 10.0 * 1024 * 1024
         self.release_str = None
         self.package_order_file = None
+        self.package_order = None
         self.arch = None
         self.real_arch = None
         self.dist_dir = None
@@ -238,6 +242,67 @@ self.reserve_size : Additional size needed to be reserved on the first disc.
 
 
 
+    def maxDiscSize(self, disc):
+        """Returns how full a binary disc may get"""
+
+        # compensate for the size of the comps package which has yet to be created
+        if disc == 1:
+            if self.arch == 'ppc' or self.arch == 'ppc64':
+                # ppc has about 15 megs of overhead in the isofs.
+                return self.target_size - self.comps_size - self.reserve_size - 15728640
+            return self.target_size - self.comps_size - self.reserve_size
+        return self.target_size
+
+
+
+    def planRPMS(self, packages, firstsize=0):
+        """Works out the split splitRPMS would make, without a tree.
+        packages is the ordered list of (filename, size) to place and
+        firstsize what is already on disc 1.  Disc usage is estimated as
+        the file sizes rounded up to 2k blocks instead of asking
+        genisoimage.  Returns a list of [first, last, size] per disc."""
+
+        self.target_size = self.disc_size * 1024.0 * 1024
+
+        discs = [[None, None, firstsize]]
+        for (file_name, filesize) in packages:
+            filesize = (filesize + 2047) // 2048 * 2048
+            disc = discs[-1]
+            if disc[0] is not None and disc[2] + filesize > self.maxDiscSize(len(discs)):
+                disc = [None, None, 0]
+                discs.append(disc)
+            if disc[0] is None:
+                disc[0] = file_name
+            disc[1] = file_name
+            disc[2] += filesize
+        return discs
+
+
+
+    def planSRPMS(self, srpms):
+        """Works out the split splitSRPMS would make for a list of
+        (filename, size), without a tree.  Returns the list of disc
+        sizes."""
+
+        srpm_list = [(size, srpm) for (srpm, size) in srpms]
+        srpm_list.sort()
+        srpm_list.reverse()
+
+        src_sizes = [0]
+        for (srpmsize, srpm) in srpm_list:
+            # Like splitSRPMS, the last disc with room wins.
+            fit = None
+            for disc in range(len(src_sizes)):
+                if src_sizes[disc] + srpmsize < self.target_size:
+                    fit = disc
+            if fit is None:
+                src_sizes.append(0)
+                fit = len(src_sizes) - 1
+            src_sizes[fit] += srpmsize
+        return src_sizes
+
+
+
     def splitRPMS(self, reportSize = 1):
         """Creates links in the split dirs for the RPMs"""
 
@@ -266,13 +331,17 @@ self.reserve_size : Additional size needed to be reserved on the first disc.
 
         orderedlist = []
 
-        # read the ordered pacakge list into orderedlist
-        orderfile = open(self.package_order_file, 'r')
-        for pkg_nvr in orderfile.readlines():
-            pkg_nvr = string.rstrip(pkg_nvr)
-            if pkg_nvr[0:8] != "warning:":
-                orderedlist.append(pkg_nvr)
-        orderfile.close()
+        if self.package_order is not None:
+            # handed to us directly
+            orderedlist = self.package_order
+        else:
+            # read the ordered pacakge list into orderedlist
+            orderfile = open(self.package_order_file, 'r')
+            for pkg_nvr in orderfile.readlines():
+                pkg_nvr = string.rstrip(pkg_nvr)
+                if pkg_nvr[0:8] != "warning:":
+                    orderedlist.append(pkg_nvr)
+            orderfile.close()
 
         # last package is the last package placed on the disc
         firstpackage = ''
@@ -292,16 +361,7 @@ self.reserve_size : Additional size needed to be reserved on the first disc.
                 curused = self.getIsoSize("%s-disc%s" % (self.dist_dir, disc))
                 filesize = os.stat("%s/%s/%s" % (self.dist_dir, pkgdir, file_name)).st_size
                 newsize = filesize + curused
-
-                # compensate for the size of the comps package which has yet to be created
-                if disc == 1:
-                    if self.arch == 'ppc' or self.arch == 'ppc64':
-                        # ppc has about 15 megs of overhead in the isofs.
-                        maxsize = self.target_size - self.comps_size - self.reserve_size - 15728640
-                    else:
-                        maxsize = self.target_size - self.comps_size - self.reserve_size
-                else:
-                    maxsize = self.target_size
+                maxsize = self.maxDiscSize(disc)
 
                 packagenum = packagenum + 1
 
@@ -0,0 +1,174 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Gather lookups answered straight from the repos' sqlite primary databases.
+
+Going through pkgSack.returnPackages() turns every package of every repo
+into a yum package object.  The queries here select rows by (indexed)
+package name instead, and only ask the sack for package objects of the rows
+that are actually wanted, leaving out the ones the sack excludes.
+"""
+
+from pypungi.debuginfo import COMMON_DEBUGINFO, DebuginfoIndex
+from pypungi.matcher import buildNameIndex
+from pypungi.sourceindex import splitSourceRpm
+
+_COLUMNS = 'pkgKey, name, arch, epoch, version, release, rpm_sourcerpm'
+
+# Stay well below sqlite's default limit of 999 bound parameters
+_CHUNK = 500
+
+def _placeholders(count):
+    return ','.join(['?'] * count)
+
+
+class PackageRow(object):
+    """A row of a primary database's packages table, with the attribute
+       names of yum's package objects."""
+
+    __slots__ = ('repo', 'pkgKey', 'name', 'arch', 'epoch', 'version',
+                 'release', 'sourcerpm')
+
+    def __init__(self, repo, row):
+        self.repo = repo
+        (self.pkgKey, self.name, self.arch, self.epoch, self.version,
+         self.release, self.sourcerpm) = row
+
+    def _pkgtup(self):
+        return (self.name, self.arch, self.epoch, self.version, self.release)
+    pkgtup = property(_pkgtup)
+
+
+class SqlSack(object):
+    """Queries over the primary databases of a list of yum repos, limited
+       to the arches of the compose."""
+
+    def __init__(self, repos, arches):
+        self.repos = list(repos)
+        self.arches = tuple(arches)
+        self.sources = {} # sourcerpm -> source package object or None
+        self.binaries = None # (name, version, release) -> rows, see binariesFor
+
+    def _select(self, where=None, params=()):
+        """Generate PackageRows for every package matching where."""
+
+        sql = 'SELECT %s FROM packages WHERE arch IN (%s)' % (
+            _COLUMNS, _placeholders(len(self.arches)))
+        if where:
+            sql += ' AND (%s)' % where
+        for repo in self.repos:
+            cur = repo.sack.primarydb[repo].cursor()
+            cur.execute(sql, self.arches + tuple(params))
+            for row in cur:
+                yield PackageRow(repo, row)
+
+    def _selectNames(self, names):
+        """Generate PackageRows for every package with one of names."""
+
+        names = list(names)
+        for start in range(0, len(names), _CHUNK):
+            chunk = names[start:start + _CHUNK]
+            for row in self._select('name IN (%s)' % _placeholders(len(chunk)), chunk):
+                yield row
+
+    def packageObject(self, row):
+        """Return the yum package object for a row, or None if it is
+           excluded."""
+
+        if row is None:
+            return None
+        sack = row.repo.sack
+        po = sack._packageByKey(row.repo, row.pkgKey)
+        if po is None:
+            return None
+        # Not every yum's _packageByKey looks at excludes, so ask the sack
+        if hasattr(sack, '_pkgExcluded'):
+            if sack._pkgExcluded(po):
+                return None
+        elif sack._excluded(row.repo, row.pkgKey):
+            return None
+        return po
+
+    def packageObjects(self, rows):
+        """Return the package objects for rows, leaving out excluded ones."""
+
+        pos = []
+        for row in rows:
+            po = self.packageObject(row)
+            if po is not None:
+                pos.append(po)
+        return pos
+
+    def nameIndex(self, names, prefixes, everything=False):
+        """Return a name index as built by matcher.buildNameIndex(), of the
+           packages with one of names or with a name starting with one of
+           prefixes (or of all packages if everything is set)."""
+
+        if everything:
+            return buildNameIndex(self.packageObjects(self._select()))
+
+        rows = list(self._selectNames(names))
+        for prefix in prefixes:
+            # The prefix is the literal part of a glob, so it has no GLOB
+            # wildcards in it, and sqlite can use the name index.
+            rows.extend(self._select('name GLOB ?', (prefix + '*',)))
+
+        seen = set()
+        unique = []
+        for row in rows:
+            if (row.repo.id, row.pkgKey) not in seen:
+                seen.add((row.repo.id, row.pkgKey))
+                unique.append(row)
+        return buildNameIndex(self.packageObjects(unique))
+
+    def sourceFor(self, po):
+        """Return the source package object for a binary package object,
+           or None if there is none."""
+
+        if not self.sources.has_key(po.sourcerpm):
+            (name, version, release) = splitSourceRpm(po.sourcerpm)
+            self.sources[po.sourcerpm] = None
+            for row in self._select("name = ? AND version = ? AND release = ? AND arch = 'src'",
+                                    (name, version, release)):
+                srpmpo = self.packageObject(row)
+                if srpmpo is not None:
+                    self.sources[po.sourcerpm] = srpmpo
+                    break
+        return self.sources[po.sourcerpm]
+
+    def binariesFor(self, srpmpo):
+        """Return the list of binary package objects built from a source
+           package object."""
+
+        if self.binaries is None:
+            # rpm_sourcerpm is not indexed, so map every binary in one scan
+            # rather than one scan per source rpm.
+            self.binaries = {}
+            for row in self._select("arch != 'src'"):
+                self.binaries.setdefault(splitSourceRpm(row.sourcerpm), []).append(row)
+        return self.packageObjects(
+            self.binaries.get((srpmpo.name, srpmpo.version, srpmpo.release), []))
+
+    def debuginfoIndex(self, pos):
+        """Return a debuginfo.DebuginfoIndex of only the debuginfo packages
+           whose names pos could match."""
+
+        names = set()
+        for po in pos:
+            names.add('%s-debuginfo' % po.name)
+            names.add('%s-debuginfo' % splitSourceRpm(po.sourcerpm)[0])
+            if po.name in COMMON_DEBUGINFO:
+                names.add('%s-debuginfo-common' % po.name)
+
+        return DebuginfoIndex(self.packageObjects(self._selectNames(names)))
@@ -0,0 +1,222 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Record why every package of a gather ended up in the tree.
+
+A DepsolveTrace is a graph of edges (requirer, requirement, provider,
+stage), where requirer is a package, a comps group ('@group') or the
+kickstart file, plus the time spent looking up the providers of each
+requirement.  Stages are 'group', 'kickstart', 'dep', 'buildreq', 'source',
+'fulltree' and 'debuginfo'.  The trace is pickled to the workdir and can
+be queried with pungi-trace.
+"""
+
+import collections
+import sys
+
+import pypungi.util
+
+_FLAGS = {'EQ': '=', 'LT': '<', 'LE': '<=', 'GT': '>', 'GE': '>='}
+
+def requirementString(req):
+    """Format a (name, flags, (epoch, version, release)) requirement."""
+
+    (name, flags, evr) = req
+    if not flags:
+        return name
+    (epoch, version, release) = evr
+    evrstr = version or ''
+    if epoch and epoch != '0':
+        evrstr = '%s:%s' % (epoch, evrstr)
+    if release:
+        evrstr = '%s-%s' % (evrstr, release)
+    return '%s %s %s' % (name, _FLAGS.get(flags, flags), evrstr)
+
+def packageLabel(po):
+    """Return name-epoch:version-release.arch for a package object."""
+
+    return '%s-%s:%s-%s.%s' % (po.name, po.epoch, po.version, po.release, po.arch)
+
+
+class DepsolveTrace(object):
+    """The edges and lookup timings of one gather.
+
+       Nodes are kept once, as (name, label) pairs, and edges refer to
+       them by index."""
+
+    def __init__(self):
+        self.nodes = []
+        self._ids = {}
+        self.edges = [] # (requirer, requirement, provider, stage)
+        self.timings = {} # requirement -> [lookups, seconds]
+
+    def _node(self, what):
+        """Return the node index for a package object or a root name."""
+
+        if isinstance(what, basestring):
+            (name, label) = (what, what)
+        else:
+            (name, label) = (what.name, packageLabel(what))
+        nodeid = self._ids.get(label)
+        if nodeid is None:
+            nodeid = len(self.nodes)
+            self._ids[label] = nodeid
+            self.nodes.append((name, label))
+        return nodeid
+
+    def addEdge(self, requirer, requirement, provider, stage):
+        """Record that requirer pulled in provider for requirement.
+           requirement may be a string or a requirement tuple."""
+
+        if not isinstance(requirement, basestring):
+            requirement = requirementString(requirement)
+        self.edges.append((self._node(requirer), requirement, self._node(provider), stage))
+
+    def addTiming(self, requirement, seconds):
+        """Record one provider lookup for a requirement tuple."""
+
+        timing = self.timings.setdefault(requirementString(requirement), [0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+
+    def write(self, path):
+        pypungi.util._writePickle(path, {'nodes': self.nodes,
+                                         'edges': self.edges,
+                                         'timings': self.timings})
+
+    def load(cls, path):
+        """Read a trace written by write(), or return None."""
+
+        cached = pypungi.util._readPickle(path)
+        if cached is None:
+            return None
+        trace = cls()
+        trace.nodes = cached['nodes']
+        trace.edges = cached['edges']
+        trace.timings = cached['timings']
+        for (nodeid, (name, label)) in enumerate(trace.nodes):
+            trace._ids[label] = nodeid
+        return trace
+    load = classmethod(load)
+
+    def _firstEdges(self):
+        """Return a dict of node -> index of the first edge leading to it,
+           which is the one that brought the package in."""
+
+        first = {}
+        for (index, (requirer, requirement, provider, stage)) in enumerate(self.edges):
+            if provider not in first and provider != requirer:
+                first[provider] = index
+        return first
+
+    def whyPaths(self, name):
+        """Return, for every package called name (or labelled name), the
+           chain of edges that first brought it in, starting at a group or
+           the kickstart file.  Each path is a list of (requirer label,
+           requirement, provider label, stage)."""
+
+        first = self._firstEdges()
+        paths = []
+        for (nodeid, (nodename, label)) in enumerate(self.nodes):
+            if name not in (nodename, label) or nodeid not in first:
+                continue
+            path = []
+            seen = set()
+            while nodeid in first and nodeid not in seen:
+                seen.add(nodeid)
+                (requirer, requirement, provider, stage) = self.edges[first[nodeid]]
+                path.append((self.nodes[requirer][1], requirement, self.nodes[provider][1], stage))
+                nodeid = requirer
+            path.reverse()
+            paths.append(path)
+        return paths
+
+    def slowest(self, count=20):
+        """Return the count requirements whose provider lookups took the
+           longest, as (seconds, lookups, requirement) tuples."""
+
+        result = [(seconds, lookups, req) for (req, (lookups, seconds)) in self.timings.iteritems()]
+        result.sort()
+        result.reverse()
+        return result[:count]
+
+    def blame(self):
+        """Return how many packages each group, kickstart entry and package
+           brought in, directly or through what it brought in, following
+           the first edge to every package.  A list of (count, label)
+           tuples, largest first."""
+
+        first = self._firstEdges()
+        children = collections.defaultdict(list)
+        for (nodeid, index) in first.iteritems():
+            children[self.edges[index][0]].append(nodeid)
+
+        result = []
+        for nodeid in range(len(self.nodes)):
+            if not children.has_key(nodeid):
+                continue
+            count = 0
+            seen = set([nodeid])
+            pending = list(children[nodeid])
+            while pending:
+                child = pending.pop()
+                if child in seen:
+                    continue
+                seen.add(child)
+                count += 1
+                pending.extend(children.get(child, ()))
+            result.append((count, self.nodes[nodeid][1]))
+        result.sort()
+        result.reverse()
+        return result
+
+
+def main(argv):
+    """pungi-trace TRACEFILE why NAME | slowest [COUNT] | blame [COUNT]"""
+
+    usage = 'Usage: pungi-trace TRACEFILE why NAME | slowest [COUNT] | blame [COUNT]'
+    if len(argv) < 2 or argv[1] not in ('why', 'slowest', 'blame') or \
+       (argv[1] == 'why' and len(argv) != 3):
+        print >> sys.stderr, usage
+        return 2
+
+    trace = DepsolveTrace.load(argv[0])
+    if trace is None:
+        print >> sys.stderr, 'Can not read trace %s' % argv[0]
+        return 1
+
+    if argv[1] == 'why':
+        paths = trace.whyPaths(argv[2])
+        if not paths:
+            print >> sys.stderr, 'Nothing pulled in %s' % argv[2]
+            return 1
+        for path in paths:
+            print path[-1][2]
+            for (requirer, requirement, provider, stage) in path:
+                print '  %-9s %s  requires %s  ->  %s' % (stage, requirer, requirement, provider)
+        return 0
+
+    count = 20
+    if len(argv) > 2:
+        count = int(argv[2])
+    if argv[1] == 'slowest':
+        for (seconds, lookups, requirement) in trace.slowest(count):
+            print '%9.3fs %5d  %s' % (seconds, lookups, requirement)
+    else:
+        for (size, label) in trace.blame()[:count]:
+            print '%6d  %s' % (size, label)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -12,6 +12,11 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+import cPickle
+import ctypes
+import errno
+import fcntl
+import filecmp
 import hashlib
 import logging
 import os
@@ -20,6 +25,23 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import thread
+
+class _LazyModule(object):
+    """Stand-in for a module that is imported on first attribute access.
+    Any submodules listed are imported along with it."""
+
+    def __init__(self, name, *submodules):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            for name in (self._name,) + self._submodules:
+                __import__(name)
+            self._module = sys.modules[self._name]
+        return getattr(self._module, attr)
 
 def _doRunCommand(command, logger, rundir=None, output=None, env=None):
     """Run a command and log the output.  Error out if we get something on stderr"""
@@ -83,21 +105,205 @@ def _doRunCommand(command, logger, rundir=None, output=None, env=None):
     else:
         logger.debug("doRunCommand: Execution of %r comleted successfully." % command[0])
 
+# ioctl to share a file's extents with another file (reflink), from linux/fs.h
+_FICLONE = 0x40049409
+
+# errnos meaning a method does not work for this pair of files, so the next
+# one should be tried.  EIO is what _kernelCopy raises for a short copy.
+_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EINVAL, errno.ENOSYS,
+                errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.ETXTBSY, errno.EIO)
+
+# method -> [files, bytes] for every file _link has put in place
+_materialized = {}
+
+_libc = None
+
+def _libcFunction(name, restype, argtypes):
+    """Return a function of the C library, or None if it has no such
+    function."""
+
+    global _libc
+    try:
+        if _libc is None:
+            _libc = ctypes.CDLL(None, use_errno=True)
+        function = getattr(_libc, name)
+    except (OSError, AttributeError):
+        return None
+    function.restype = restype
+    function.argtypes = argtypes
+    return function
+
+def _reflink(src, dst, size):
+    fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+def _kernelCopy(call, src, dst, size):
+    """Copy size bytes with a copy_file_range or sendfile like call, which
+    moves data between the two files inside the kernel.  Raises OSError
+    with EIO if the call stops before size bytes, so the copy is redone by
+    the next method rather than left short."""
+
+    done = 0
+    while done < size:
+        count = call(src.fileno(), dst.fileno(), min(size - done, 1 << 30))
+        if count < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            raise OSError(err, os.strerror(err))
+        if count == 0:
+            break
+        done += count
+    if done < size:
+        raise OSError(errno.EIO, 'copied %d of %d bytes' % (done, size))
+
+def _copyFileRange(src, dst, size):
+    function = _libcFunction('copy_file_range', ctypes.c_ssize_t,
+                             [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                              ctypes.c_size_t, ctypes.c_uint])
+    if function is None:
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+    _kernelCopy(lambda infd, outfd, count: function(infd, None, outfd, None, count, 0),
+                src, dst, size)
+
+def _sendfile(src, dst, size):
+    function = _libcFunction('sendfile', ctypes.c_ssize_t,
+                             [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+    if function is None:
+        raise OSError(errno.ENOSYS, 'sendfile is not available')
+    _kernelCopy(lambda infd, outfd, count: function(outfd, infd, None, count),
+                src, dst, size)
+
+def _bufferedCopy(src, dst, size):
+    shutil.copyfileobj(src, dst, 1024 * 1024)
+
+_COPIES = (('reflink', _reflink),
+           ('copy_file_range', _copyFileRange),
+           ('sendfile', _sendfile),
+           ('copy', _bufferedCopy))
+
+def _copyFile(local, target):
+    """Copy local to target with the cheapest method the file systems
+    allow: a reflink, a copy inside the kernel, or a plain copy.  Mode and
+    times are copied like shutil.copy2 does.  Returns the method used."""
+
+    src = open(local, 'rb')
+    try:
+        dst = open(target, 'wb')
+        try:
+            size = os.fstat(src.fileno()).st_size
+            for (method, copy) in _COPIES:
+                try:
+                    copy(src, dst, size)
+                    break
+                except (IOError, OSError), e:
+                    if method == 'copy' or e.errno not in _UNSUPPORTED:
+                        raise
+                    # Start over with the next method
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    shutil.copystat(local, target)
+    return method
+
+def _tempName(path):
+    """Return a name next to path that no other process or thread uses, to
+    build a file under before renaming it into place."""
+
+    return '%s.%d.%d.tmp' % (path, os.getpid(), thread.get_ident())
+
+def _sameFile(local, target):
+    """Return whether target is local or a file with the same content."""
+
+    try:
+        return os.path.samefile(local, target) or \
+               filecmp.cmp(local, target, shallow=False)
+    except OSError:
+        return False
+
 def _link(local, target, logger, force=False):
-    """Simple function to link or copy a package, removing target optionally."""
+    """Simple function to link or copy a package, removing target optionally.
+
+    Tries a hardlink, then a reflink, then copies inside the kernel, then
+    copies through a buffer.  A copy is made under a temporary name and
+    renamed into place, so target is never seen half written.  Returns the
+    method used, which is also counted in _materialized."""
 
-    if os.path.exists(target) and force:
-        os.remove(target)
+    if force:
+        try:
+            os.remove(target)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
 
     try:
         os.link(local, target)
+        method = 'hardlink'
     except OSError, e:
-        if e.errno != 18: # EXDEV
+        if e.errno == errno.EEXIST and force and _sameFile(local, target):
+            # Put there meanwhile by another process sharing the directory,
+            # like the gather of another arch in the source dir
+            logger.debug('%s is already in place' % target)
+            return 'hardlink'
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
             logger.error('Got an error linking from cache: %s' % e)
             raise OSError, e
 
         # Can't hardlink cross file systems
-        shutil.copy2(local, target)
+        tmppath = _tempName(target)
+        try:
+            method = _copyFile(local, tmppath)
+            os.rename(tmppath, target)
+        except:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+
+    size = os.path.getsize(target)
+    counts = _materialized.setdefault(method, [0, 0])
+    counts[0] += 1
+    counts[1] += size
+    logger.debug('Put %s in place by %s (%d bytes)' % (target, method, size))
+    return method
+
+def _materializeStats(logger, what):
+    """Log how the files _link put in place since the last call got there,
+    and start counting again."""
+
+    if not _materialized:
+        return
+    logger.info('%s: %s' % (what, ', '.join(
+        ['%d files (%d MiB) by %s' % (files, size / 1024 / 1024, method)
+         for (method, (files, size)) in sorted(_materialized.items())])))
+    _materialized.clear()
+
+def _copyTree(src, dst, logger):
+    """Like shutil.copytree, but puts each file in place with _link."""
+
+    _ensuredir(dst, logger, force=True)
+    for name in os.listdir(src):
+        srcpath = os.path.join(src, name)
+        dstpath = os.path.join(dst, name)
+        if os.path.isdir(srcpath):
+            _copyTree(srcpath, dstpath, logger)
+        else:
+            _link(os.path.realpath(srcpath), dstpath, logger, force=True)
+    shutil.copystat(src, dst)
+
+def _lockFile(path):
+    """Open path and take an exclusive lock on it, waiting while another
+    process or thread holds it.  Closing the returned file unlocks it."""
+
+    lockfile = open(path, 'a')
+    try:
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+    except:
+        lockfile.close()
+        raise
+    return lockfile
 
 def _ensuredir(target, logger, force=False, clean=False):
     """Ensure that a directory exists, if it already exists, only continue
@@ -136,9 +342,22 @@ def _ensuredir(target, logger, force=False, clean=False):
             sys.stderr(message)
         sys.exit(1)
 
-def _doCheckSum(path, hash, logger):
+def _doCheckSum(path, hash, logger, memo=None):
     """Generate a checksum hash from a provided path.
-    Return a string of type:hash"""
+    Return a string of type:hash
+
+    With a checksums.ChecksumMemo, a file it has already summed and that
+    has not changed since is not read again."""
+
+    if memo is not None:
+        try:
+            return '%s:%s' % (hash, memo.hexdigest(path, hash))
+        except ValueError:
+            logger.error("Invalid hash type: %s" % hash)
+            return False
+        except (IOError, OSError), e:
+            logger.error("Could not open file %s: %s" % (path, e))
+            return False
 
     # Try to figure out what hash we want to do
     try:
@@ -164,3 +383,35 @@ def _doCheckSum(path, hash, logger):
     myfile.close()
 
     return '%s:%s' % (hash, sum.hexdigest())
+
+def _writePickle(path, obj):
+    """Pickle obj to path, writing to a temporary file first so readers
+    never see a partially written file."""
+
+    (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.pungi')
+    out = os.fdopen(fd, 'wb')
+    try:
+        cPickle.dump(obj, out, cPickle.HIGHEST_PROTOCOL)
+        out.close()
+    except:
+        out.close()
+        os.remove(tmppath)
+        raise
+    os.rename(tmppath, path)
+
+def _readPickle(path):
+    """Load a pickle written by _writePickle.  Returns None if the file is
+    missing or can not be read back."""
+
+    try:
+        cached = open(path, 'rb')
+    except IOError:
+        return None
+
+    try:
+        try:
+            return cPickle.load(cached)
+        except (EOFError, cPickle.UnpicklingError, ValueError, AttributeError, ImportError):
+            return None
+    finally:
+        cached.close()
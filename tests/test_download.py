@@ -0,0 +1,145 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Tests for pypungi.download against a local http server."""
+
+import BaseHTTPServer
+import hashlib
+import logging
+import os
+import re
+import shutil
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pypungi.download
+
+DATA = os.urandom(3 * 1024 * 1024 + 5)
+CHECKSUM = hashlib.sha256(DATA).hexdigest()
+
+# What the server does; the tests set it up before each download
+state = {'drops': 0, 'requests': []}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves DATA as /pkg.rpm, with Range support.  While state['drops']
+       is above zero a request gets the first megabyte and then the
+       connection is cut."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        state['requests'].append((self.path, self.headers.getheader('Range')))
+        if self.path != '/pkg.rpm':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.getheader('Range') or '')
+        if match:
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(DATA) - 1, len(DATA)))
+        else:
+            self.send_response(200)
+        body = DATA[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if state['drops'] > 0:
+            state['drops'] -= 1
+            self.wfile.write(body[:1024 * 1024])
+            self.wfile.flush()
+            self.close_connection = 1
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.wfile.write(body)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class DownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        state['drops'] = 0
+        state['requests'] = []
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.baseurl = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.tmpdir = tempfile.mkdtemp()
+        self.partialdir = os.path.join(self.tmpdir, 'partial')
+        os.mkdir(self.partialdir)
+        self.logger = logging.getLogger('test_download')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def download(self, name='pkg.rpm'):
+        return pypungi.download.Download(['%s/%s' % (self.baseurl, name)],
+                                         os.path.join(self.tmpdir, name),
+                                         len(DATA), 'sha256', CHECKSUM)
+
+    def testResumeWithRange(self):
+        state['drops'] = 1
+        download = self.download()
+        downloader = pypungi.download.Downloader(self.logger, partialdir=self.partialdir,
+                                                 retries=0)
+        self.assertEqual(downloader.run([download]).keys(), [download])
+        self.failIf(os.path.exists(download.path))
+
+        # The next run asks for the rest only
+        self.assertEqual(downloader.run([download]), {})
+        self.assertEqual(open(download.path, 'rb').read(), DATA)
+        self.assertEqual(state['requests'], [('/pkg.rpm', None),
+                                             ('/pkg.rpm', 'bytes=%d-' % (1024 * 1024))])
+        self.assertEqual(os.listdir(self.partialdir), [])
+
+    def testRetryAfterDrop(self):
+        state['drops'] = 1
+        download = self.download()
+        downloader = pypungi.download.Downloader(self.logger, retries=1, backoff=0.01)
+        self.assertEqual(downloader.run([download]), {})
+        self.assertEqual(open(download.path, 'rb').read(), DATA)
+        self.assertEqual(len(state['requests']), 2)
+
+    def test404Fails(self):
+        download = self.download('missing.rpm')
+        downloader = pypungi.download.Downloader(self.logger, partialdir=self.partialdir,
+                                                 retries=1, backoff=0.01)
+        failed = downloader.run([download])
+        self.assertEqual(failed.keys(), [download])
+        self.failUnless('HTTP 404' in failed[download][0])
+        self.failIf(os.path.exists(download.path))
+        self.assertEqual(len(state['requests']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()